@@ -1,67 +1,260 @@
-from flask import Flask, render_template, request, redirect, flash
-from database import get_db
+import os
+import hashlib
+from urllib.parse import urlsplit
+from datetime import date, datetime
+from flask import (Flask, Response, g, jsonify, render_template, request, redirect, flash, session,
+                   send_file)
+from flask.json.provider import DefaultJSONProvider
+from database import get_db, init_app, pool_metrics
+from cache import cache_metrics, lookup_cache, page_cache
+import instrumentation
+import export_jobs
+from partitions import start_partition_maintenance
+from queries import (RETURN_STATUSES, PAGE_SIZE, SELLERS_SQL, CUSTOMER_BY_ID_SQL, CUSTOMER_SEARCH_SQL,
+                     RETURN_BY_ID_SQL, INSERT_RETURN_SQL, UPDATE_RETURN_SQL, CUSTOMER_SEARCH_LIMIT, parse_return_filters,
+                     parse_int, parse_page_size, parse_search_limit, returns_page_query, split_page,
+                     customer_search_params, execute_prepared)
+from records import RecordCursor, as_dicts
+from bulk import MAX_BULK_ITEMS, create_returns_bulk, parse_csv_items, update_return_status_bulk
 import psycopg2.extras
 
+class IsoJSONProvider(DefaultJSONProvider):
+    # ISO-8601 dates and timestamps, as the async API writes them, instead of Flask's RFC 822 strings
+    @staticmethod
+    def default(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return DefaultJSONProvider.default(value)
+
 app = Flask(__name__)
+app.json = IsoJSONProvider(app)
 app.secret_key = 'your_secret_key_here'
+init_app(app)
+instrumentation.init_app(app)
 
 try:
-    import init_db
-    init_db.init_db()
-    print("Database initialized successfully")
+    import migrations
+    migrations.ensure_schema()
+    print("Database schema is up to date")
 except Exception as e:
-    print(f"Database initialization error: {e}")
+    print(f"Database migration error: {e}")
+
+start_partition_maintenance()
+
+def load_sellers():
+    conn = get_db(readonly=True)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cur.execute(SELLERS_SQL)
+    sellers = [dict(row) for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+    return sellers
+
+def read_failed(what, e):
+    # The page still renders, but conditional_listing must not cache it or give it an ETag
+    print(f"Error getting {what}: {e}")
+    g.read_failed = True
 
 def get_sellers():
     try:
-        conn = get_db()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM users WHERE user_type = 'seller'")
-        sellers = cur.fetchall()
-        cur.close()
-        conn.close()
-        return sellers
+        return lookup_cache.get_or_load('sellers', load_sellers)
     except Exception as e:
-        print(f"Error getting sellers: {e}")
+        read_failed('sellers', e)
         return []
 
-def get_customers():
+ADMIN_ID = 5
+
+# /admin/events is served by the async API (async_api.py, live.py), which holds no worker per open
+# stream. Unset, the admin page connects to the same host on ASYNC_API_PORT.
+LIVE_EVENTS_URL = os.environ.get('LIVE_EVENTS_URL') or None
+ASYNC_API_PORT = os.environ.get('ASYNC_API_PORT', '5001')
+# Downloads of exports still running are redirected there too; unset, the same host on ASYNC_API_PORT
+ASYNC_API_URL = os.environ.get('ASYNC_API_URL') or None
+
+def search_customers(query, limit=CUSTOMER_SEARCH_LIMIT):
+    # Substring match served by the trigram index; closest matches first
+    params = customer_search_params(query, limit)
+    if params is None:
+        return []
     try:
-        conn = get_db()
+        conn = get_db(readonly=True)
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM customers")
+        cur.execute(CUSTOMER_SEARCH_SQL, params)
         customers = cur.fetchall()
         cur.close()
         conn.close()
         return customers
     except Exception as e:
-        print(f"Error getting customers: {e}")
+        print(f"Error searching customers: {e}")
         return []
 
-def get_returns_with_relations():
+def get_customer(customer_id):
+    if not customer_id:
+        return None
     try:
-        conn = get_db()
+        conn = get_db(readonly=True)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(CUSTOMER_BY_ID_SQL, (customer_id,))
+        customer = cur.fetchone()
+        cur.close()
+        conn.close()
+        return customer
+    except Exception as e:
+        read_failed('customer', e)
+        return None
+
+def get_returns_with_relations(filters=None, cursor=None, limit=PAGE_SIZE):
+    try:
+        conn = get_db(readonly=True)
+        cur = conn.cursor(cursor_factory=RecordCursor)
+        sql, params = returns_page_query(filters, cursor, limit)
+        if filters and filters.get('q'):
+            # Ranking cost depends on the terms, so search is planned per query rather than prepared
+            cur.execute(sql, params)
+        else:
+            execute_prepared(cur, sql, params)
+        returns = cur.fetchall()
+        cur.close()
+        conn.close()
+        return split_page(returns, limit)
+    except Exception as e:
+        read_failed('returns', e)
+        return [], None
+
+def get_return(return_id):
+    try:
+        conn = get_db(readonly=True)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        execute_prepared(cur, RETURN_BY_ID_SQL, (return_id,))
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        return row
+    except Exception as e:
+        print(f"Error getting return: {e}")
+        return None
+
+def get_returns_version():
+    # Cheap change detector: the trigger-maintained counter every write to returns bumps
+    try:
+        conn = get_db(readonly=True)
+        cur = conn.cursor()
+        execute_prepared(cur, 'SELECT version FROM return_changes')
+        version = cur.fetchone()[0]
+        cur.close()
+        conn.close()
+        return version
+    except Exception as e:
+        print(f"Error getting returns version: {e}")
+        return None
+
+class DegradedPage(Exception):
+    def __init__(self, body):
+        super().__init__('page rendered after a failed read')
+        self.body = body
+
+def degraded_response(body, mimetype):
+    response = Response(body, status=503, mimetype=mimetype)
+    response.cache_control.no_store = True
+    return response
+
+def conditional_listing(render, mimetype='text/html'):
+    # Pending flash messages are part of the page, so those responses are never cached
+    version = get_returns_version()
+    if version is None or session.get('_flashes'):
+        body = render()
+        return degraded_response(body, mimetype) if g.get('read_failed') else Response(body, mimetype=mimetype)
+
+    key = f"{request.endpoint}|{request.query_string.decode()}|{version}|{date.today()}"
+    etag = hashlib.sha1(key.encode()).hexdigest()
+
+    def checked_render():
+        # Raising keeps a page built from a failed read out of page_cache
+        body = render()
+        if g.get('read_failed'):
+            raise DegradedPage(body)
+        return body
+
+    # ETag only: the version is a counter, not a date a Last-Modified header could carry
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            response = Response(page_cache.get_or_load(etag, checked_render), mimetype=mimetype)
+        except DegradedPage as e:
+            return degraded_response(e.body, mimetype)
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def get_return_counts():
+    counts = dict.fromkeys(RETURN_STATUSES, 0)
+    try:
+        conn = get_db(readonly=True)
+        cur = conn.cursor()
+        cur.execute("SELECT status, count FROM return_status_counts")
+        for status, count in cur.fetchall():
+            counts[status] = count
+        cur.close()
+        conn.close()
+    except Exception as e:
+        read_failed('return counts', e)
+    counts['total'] = sum(counts.values())
+    return counts
+
+def pivot_status_counts(rows, key, label=None):
+    breakdown = {}
+    for row in rows:
+        entry = breakdown.get(row[key])
+        if entry is None:
+            entry = breakdown[row[key]] = dict.fromkeys(RETURN_STATUSES, 0)
+            if label:
+                entry['label'] = row[label]
+        entry[row['status']] = row['count']
+    for entry in breakdown.values():
+        entry['total'] = sum(entry[status] for status in RETURN_STATUSES)
+    return breakdown
+
+def get_seller_breakdown():
+    try:
+        conn = get_db(readonly=True)
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         cur.execute('''
-                    SELECT
-                        r.*,
-                        s.name as seller_name,
-                        c.first_name as customer_first_name,
-                        c.last_name as customer_last_name,
-                        a.name as admin_name
-                    FROM returns r
-                             LEFT JOIN users s ON r.seller_id = s.id
-                             LEFT JOIN customers c ON r.customer_id = c.id
-                             LEFT JOIN users a ON r.admin_id = a.id
-                    ORDER BY r.created_at DESC
+                    SELECT c.seller_id, COALESCE(s.name, 'Unknown') as seller_name, c.status,
+                           SUM(c.count)::bigint as count
+                    FROM return_seller_counts c
+                             LEFT JOIN users s ON c.seller_id = s.id
+                    GROUP BY c.seller_id, s.name, c.status
+                    ORDER BY s.name, c.seller_id
                     ''')
-        returns = cur.fetchall()
+        rows = cur.fetchall()
         cur.close()
         conn.close()
-        return returns
+        # Keyed by id: seeded sellers often share a name, which is only the display label
+        return pivot_status_counts(rows, 'seller_id', 'seller_name')
     except Exception as e:
-        print(f"Error getting returns: {e}")
-        return []
+        read_failed('seller breakdown', e)
+        return {}
+
+def get_daily_breakdown(days=14):
+    try:
+        conn = get_db(readonly=True)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute('''
+                    SELECT day, status, SUM(count)::bigint as count
+                    FROM return_daily_counts
+                    WHERE day > CURRENT_DATE - %s
+                    GROUP BY day, status
+                    ORDER BY day DESC
+                    ''', (days,))
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return pivot_status_counts(rows, 'day')
+    except Exception as e:
+        read_failed('daily breakdown', e)
+        return {}
 
 @app.route('/')
 def index():
@@ -70,23 +263,21 @@ def index():
 @app.route('/returns', methods=['GET', 'POST'])
 def returns_page():
     sellers = get_sellers()
-    customers = get_customers()
 
     if request.method == 'POST':
         try:
             seller_id = request.form['seller_id']
-            customer_id = request.form['customer_id']
+            # The picker only fills customer_id once a search result is chosen
+            customer_id = parse_int(request.form.get('customer_id'))
+            if customer_id is None:
+                raise ValueError('pick a customer from the search results')
             purchase_date = request.form['purchase_date']
             product_name = request.form['product_name']
             reason = request.form['reason']
 
             conn = get_db()
             cur = conn.cursor()
-            cur.execute('''
-                        INSERT INTO returns
-                            (seller_id, customer_id, purchase_date, product_name, reason)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ''', (seller_id, customer_id, purchase_date, product_name, reason))
+            cur.execute(INSERT_RETURN_SQL, (seller_id, customer_id, purchase_date, product_name, reason))
 
             conn.commit()
             cur.close()
@@ -98,41 +289,253 @@ def returns_page():
         except Exception as e:
             flash(f'Error creating return: {e}', 'error')
 
-    returns = get_returns_with_relations()
-    return render_template('returns.html', returns=returns, sellers=sellers, customers=customers)
+    def render():
+        filters = parse_return_filters(request.args)
+        returns, next_cursor = get_returns_with_relations(filters, request.args.get('cursor'),
+                                                          parse_page_size(request.args))
+        filter_customer = get_customer(filters.get('customer_id'))
+        return render_template('returns.html', returns=returns, sellers=sellers,
+                               filters=filters, filter_customer=filter_customer, next_cursor=next_cursor)
+
+    return conditional_listing(render)
 
 @app.route('/update_return/<int:return_id>', methods=['POST'])
 def update_return(return_id):
+    # The live admin page posts in the background and gets the new row from /admin/events
+    wants_json = request.accept_mimetypes.best == 'application/json'
     try:
         status = request.form['status']
         comment = request.form.get('comment', '')
 
-        admin_id = 5
+        admin_id = ADMIN_ID
 
         conn = get_db()
         cur = conn.cursor()
-        cur.execute('''
-                    UPDATE returns
-                    SET status = %s, comment = %s, admin_id = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                    ''', (status, comment, admin_id, return_id))
+        cur.execute(UPDATE_RETURN_SQL, (status, comment, admin_id, return_id))
 
         conn.commit()
         cur.close()
         conn.close()
 
+        if wants_json:
+            return jsonify({'id': return_id, 'status': status})
         flash('Return status updated successfully', 'success')
     except Exception as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
         flash(f'Error updating return: {e}', 'error')
 
     return redirect('/admin')
 
+@app.route('/bulk_update_returns', methods=['POST'])
+def bulk_update_returns():
+    return_ids = request.form.getlist('return_ids')
+    if not return_ids:
+        flash('No returns selected', 'error')
+        return redirect('/admin')
+
+    try:
+        updated, errors = update_return_status_bulk(return_ids, request.form['status'],
+                                                    request.form.get('comment', ''), ADMIN_ID)
+        flash(f'{len(updated)} returns updated', 'success')
+        for error in errors:
+            flash(f"Return {error['id']}: {error['error']}", 'error')
+    except Exception as e:
+        flash(f'Error updating returns: {e}', 'error')
+
+    return redirect('/admin')
+
 @app.route('/admin')
 def admin():
-    returns = get_returns_with_relations()
-    sellers = get_sellers()
-    customers = get_customers()
-    return render_template('admin.html', returns=returns, sellers=sellers, customers=customers)
+    def render():
+        filters = parse_return_filters(request.args)
+        returns, next_cursor = get_returns_with_relations(filters, request.args.get('cursor'),
+                                                          parse_page_size(request.args))
+        counts = get_return_counts()
+        seller_counts = get_seller_breakdown()
+        daily_counts = get_daily_breakdown()
+        sellers = get_sellers()
+        filter_customer = get_customer(filters.get('customer_id'))
+        return render_template('admin.html', returns=returns, sellers=sellers, filter_customer=filter_customer,
+                               filters=filters, next_cursor=next_cursor, counts=counts,
+                               seller_counts=seller_counts, daily_counts=daily_counts,
+                               live_events_url=LIVE_EVENTS_URL, live_events_port=ASYNC_API_PORT)
+
+    return conditional_listing(render)
+
+@app.route('/api/customers/search')
+def api_customer_search():
+    return jsonify({'customers': search_customers(request.args.get('q', ''), parse_search_limit(request.args))})
+
+@app.route('/api/stats')
+def api_stats():
+    def render():
+        return app.json.dumps({
+            'counts': get_return_counts(),
+            'by_seller': get_seller_breakdown(),
+            'by_day': {day.isoformat(): entry for day, entry in get_daily_breakdown().items()}
+        })
+
+    return conditional_listing(render, 'application/json')
+
+@app.route('/api/returns')
+def api_returns():
+    def render():
+        filters = parse_return_filters(request.args)
+        returns, next_cursor = get_returns_with_relations(filters, request.args.get('cursor'),
+                                                          parse_page_size(request.args))
+        return app.json.dumps({'returns': as_dicts(returns), 'next_cursor': next_cursor, 'filters': filters})
+
+    return conditional_listing(render, 'application/json')
+
+@app.route('/api/returns/search')
+def api_search_returns():
+    filters = parse_return_filters(request.args)
+    if not filters.get('q'):
+        return jsonify({'error': 'q is required'}), 400
+
+    def render():
+        returns, next_cursor = get_returns_with_relations(filters, request.args.get('cursor'),
+                                                          parse_page_size(request.args))
+        return app.json.dumps({'returns': as_dicts(returns), 'next_cursor': next_cursor, 'query': filters['q'],
+                               'filters': filters})
+
+    return conditional_listing(render, 'application/json')
+
+@app.route('/api/returns/<int:return_id>')
+def api_return(return_id):
+    row = get_return(return_id)
+    if row is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(row)
+
+@app.route('/api/sellers')
+def api_sellers():
+    return jsonify({'sellers': get_sellers()})
+
+@app.route('/api/returns/bulk', methods=['POST'])
+def api_returns_bulk():
+    if 'file' in request.files:
+        try:
+            items = parse_csv_items(request.files['file'].read().decode('utf-8-sig'))
+        except UnicodeDecodeError:
+            return jsonify({'error': 'the uploaded file is not UTF-8 encoded CSV'}), 400
+    elif request.mimetype == 'text/csv':
+        items = parse_csv_items(request.get_data(as_text=True))
+    else:
+        payload = request.get_json(silent=True)
+        items = payload.get('returns') if isinstance(payload, dict) else payload
+
+    if not isinstance(items, list):
+        return jsonify({'error': 'expected a JSON list of returns or a CSV upload'}), 400
+    if len(items) > MAX_BULK_ITEMS:
+        return jsonify({'error': f'at most {MAX_BULK_ITEMS} returns per request'}), 413
+
+    try:
+        created, errors = create_returns_bulk(items)
+    except Exception as e:
+        print(f"Error creating returns: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'created': created, 'errors': errors}), 200 if created or not errors else 400
+
+@app.route('/api/returns/bulk_status', methods=['POST'])
+def api_returns_bulk_status():
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get('ids')
+    if not isinstance(ids, list):
+        return jsonify({'error': 'expected {"ids": [...], "status": ..., "comment": ...}'}), 400
+    if len(ids) > MAX_BULK_ITEMS:
+        return jsonify({'error': f'at most {MAX_BULK_ITEMS} ids per request'}), 413
+
+    try:
+        updated, errors = update_return_status_bulk(ids, payload.get('status'), payload.get('comment', ''), ADMIN_ID)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error updating returns: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'updated': updated, 'errors': errors})
+
+def export_job_view(job):
+    view = {key: value for key, value in job.items() if key not in ('pid', 'host')}
+    if job['status'] == 'done':
+        view['progress'] = 1.0
+    else:
+        view['progress'] = round(min(job['rows'] / job['total'], 1.0), 4) if job['total'] else None
+    view['status_url'] = f"/api/exports/{job['id']}"
+    view['download_url'] = f"/api/exports/{job['id']}/download"
+    return view
+
+@app.route('/api/exports', methods=['POST'])
+def api_create_export():
+    # Body: {"table": "returns", "format": "csv", "compression": null, "filters": {...}}; filters use the
+    # listing's parameters and may also come from the query string
+    payload = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'expected a JSON object'}), 400
+    table = payload.get('table', 'returns')
+    format_name = payload.get('format', 'csv')
+    compression = payload.get('compression') or None
+    raw_filters = payload.get('filters')
+    filters = parse_return_filters(raw_filters if isinstance(raw_filters, dict) else request.args)
+
+    jobs = export_jobs.get_jobs()
+    error = jobs.validate(table, format_name, compression, filters)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        job = jobs.submit(table, format_name, compression, filters)
+    except export_jobs.JobQueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+
+    response = jsonify(export_job_view(job))
+    response.headers['Location'] = f"/api/exports/{job['id']}"
+    return response, 202
+
+@app.route('/api/exports')
+def api_exports():
+    return jsonify({'exports': [export_job_view(job) for job in export_jobs.get_jobs().list()]})
+
+@app.route('/api/exports/<job_id>')
+def api_export(job_id):
+    job = export_jobs.get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(export_job_view(job))
+
+@app.route('/api/exports/<job_id>/download')
+def api_export_download(job_id):
+    # Finished files are served whole; a text export still running is streamed by the async API as it
+    # is written, so the client can start reading straight after queueing it
+    job = export_jobs.get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'], 'export': export_job_view(job)}), 409
+
+    if job['status'] == 'done':
+        path = export_jobs.output_path(job)
+        if not os.path.exists(path):
+            return jsonify({'error': 'export file is missing', 'export': export_job_view(job)}), 410
+        return send_file(os.path.abspath(path), mimetype=export_jobs.mimetype(job), as_attachment=True,
+                         download_name=export_jobs.download_name(job))
+
+    if not export_jobs.streamable(job):
+        return jsonify({'error': f"{job['format']} exports can be downloaded once finished",
+                        'export': export_job_view(job)}), 409
+
+    base_url = ASYNC_API_URL or f"{request.scheme}://{urlsplit(request.host_url).hostname}:{ASYNC_API_PORT}"
+    return redirect(f"{base_url.rstrip('/')}/api/exports/{job_id}/download", code=307)
+
+@app.route('/metrics')
+def metrics():
+    return Response(pool_metrics() + cache_metrics() + instrumentation.request_metrics() +
+                    export_jobs.export_job_metrics(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     print("Starting Returns Management System")
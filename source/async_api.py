@@ -0,0 +1,234 @@
+import os
+import json
+import asyncio
+from datetime import date, datetime
+import asyncpg
+from aiohttp import web
+from database import DB_CONFIG
+from queries import (SELLERS_SQL, CUSTOMERS_SQL, CUSTOMER_SEARCH_SQL, RETURN_BY_ID_SQL, INSERT_RETURN_SQL,
+                     UPDATE_RETURN_SQL, RETURN_STATUSES, numbered, parse_int, parse_return_filters,
+                     parse_page_size, parse_search_limit, returns_page_query, split_page, customer_search_params)
+from bulk import validate_return_item
+from partitions import start_partition_maintenance
+import export_jobs
+import live
+
+# Same JSON API as the Flask app, served from asyncio for throughput comparisons. Also serves the
+# admin page's live event stream and downloads of exports still running, which would each tie up a
+# Flask worker for as long as they stay open
+
+ASYNC_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', '2'))
+ASYNC_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', '20'))
+ADMIN_ID = 5
+
+
+def to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status, dumps=lambda obj: json.dumps(obj, default=to_json))
+
+
+async def fetch(request, sql, *params):
+    rows = await request.app['pool'].fetch(numbered(sql), *params)
+    return [dict(row) for row in rows]
+
+
+async def list_returns(request):
+    filters = parse_return_filters(request.query)
+    limit = parse_page_size(request.query)
+    sql, params = returns_page_query(filters, request.query.get('cursor'), limit)
+    returns, next_cursor = split_page(await fetch(request, sql, *params), limit)
+    return json_response({'returns': returns, 'next_cursor': next_cursor, 'filters': filters})
+
+
+async def get_return(request):
+    rows = await fetch(request, RETURN_BY_ID_SQL, int(request.match_info['return_id']))
+    if not rows:
+        return json_response({'error': 'not found'}, 404)
+    return json_response(rows[0])
+
+
+async def create_return(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return json_response({'error': 'expected a JSON object'}, 400)
+
+    row, error = validate_return_item(payload)
+    if error:
+        return json_response({'error': error}, 400)
+
+    try:
+        return_id = await request.app['pool'].fetchval(numbered(INSERT_RETURN_SQL), *row)
+    except asyncpg.ForeignKeyViolationError as e:
+        return json_response({'error': str(e)}, 400)
+    return json_response({'id': return_id}, 201)
+
+
+async def update_return(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return json_response({'error': 'expected a JSON object'}, 400)
+
+    status = payload.get('status') if isinstance(payload, dict) else None
+    if status not in RETURN_STATUSES:
+        return json_response({'error': f"status must be one of {', '.join(RETURN_STATUSES)}"}, 400)
+    comment = payload.get('comment', '')
+    if comment is not None and not isinstance(comment, str):
+        return json_response({'error': 'comment must be a string'}, 400)
+
+    return_id = await request.app['pool'].fetchval(
+        numbered(UPDATE_RETURN_SQL), status, comment, ADMIN_ID,
+        int(request.match_info['return_id']))
+    if return_id is None:
+        return json_response({'error': 'not found'}, 404)
+    return json_response({'id': return_id, 'status': status})
+
+
+async def list_sellers(request):
+    return json_response({'sellers': await fetch(request, SELLERS_SQL)})
+
+
+async def list_customers(request):
+    query = request.query.get('q')
+    if query is None:
+        # Without a search term return one page rather than the whole table
+        limit = parse_search_limit(request.query)
+        offset = max(parse_int(request.query.get('offset'), 0), 0)
+        customers = await fetch(request, CUSTOMERS_SQL + ' LIMIT %s OFFSET %s', limit, offset)
+        return json_response({'customers': customers})
+
+    params = customer_search_params(query, parse_search_limit(request.query))
+    customers = await fetch(request, CUSTOMER_SEARCH_SQL, *params) if params else []
+    return json_response({'customers': customers})
+
+
+def connection_settings():
+    return {
+        'host': DB_CONFIG['host'],
+        'database': DB_CONFIG['database'],
+        'user': DB_CONFIG['user'],
+        'password': DB_CONFIG['password'],
+        'port': int(DB_CONFIG['port'])
+    }
+
+
+async def open_pool(app):
+    app['pool'] = await asyncpg.create_pool(
+        min_size=ASYNC_POOL_MIN_SIZE,
+        max_size=ASYNC_POOL_MAX_SIZE,
+        **connection_settings()
+    )
+
+
+async def start_live(app):
+    # The LISTEN connection is separate from the pool so it is never handed to a query
+    app['live'] = live.ChangeListener(app['pool'], lambda: asyncpg.connect(**connection_settings()))
+    app['live_task'] = asyncio.ensure_future(app['live'].run())
+
+
+async def stop_live(app):
+    app['live_task'].cancel()
+    try:
+        await app['live_task']
+    except asyncio.CancelledError:
+        pass
+
+
+async def admin_events(request):
+    return await live.event_stream(request, request.app['live'])
+
+
+async def export_download(request):
+    # A text export still running, sent as it is written. Reads job.json rather than asking the
+    # process running the job, so it works for jobs queued by any Flask worker sharing EXPORT_JOBS_DIR
+    job_id = request.match_info['job_id']
+    job = export_jobs.load_job(job_id)
+    if job is None:
+        return json_response({'error': 'not found'}, 404)
+    if job['status'] == 'failed':
+        return json_response({'error': job['error']}, 409)
+    if job['status'] not in export_jobs.FINISHED and not export_jobs.streamable(job):
+        return json_response({'error': f"{job['format']} exports can be downloaded once finished"}, 409)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': export_jobs.mimetype(job),
+        'Content-Disposition': f"attachment; filename={export_jobs.download_name(job)}",
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+
+    path = export_jobs.output_path(job)
+    f = None
+    idle = 0.0
+    try:
+        while True:
+            if f is None and os.path.exists(path):
+                f = open(path, 'rb')
+            chunk = f.read(export_jobs.DOWNLOAD_CHUNK_SIZE) if f is not None else b''
+            if chunk:
+                await response.write(chunk)
+                idle = 0.0
+                continue
+            if job['status'] in export_jobs.FINISHED:
+                break
+            if idle >= export_jobs.DOWNLOAD_STALL_SECONDS:
+                raise RuntimeError(f"Export job {job_id} stopped writing")
+            # The status is read before the next read, so bytes written just before finishing are not lost
+            await asyncio.sleep(export_jobs.DOWNLOAD_POLL_SECONDS)
+            idle += export_jobs.DOWNLOAD_POLL_SECONDS
+            job = export_jobs.load_job(job_id) or {'status': 'failed', 'error': 'the export was removed'}
+    except ConnectionResetError:
+        return response
+    finally:
+        if f is not None:
+            f.close()
+
+    if job['status'] == 'failed':
+        # Dropping the connection mid-body tells the client the file is incomplete
+        raise RuntimeError(f"Export job {job_id} failed: {job['error']}")
+    await response.write_eof()
+    return response
+
+
+async def metrics(request):
+    return web.Response(text=live.live_metrics(request.app['live']), content_type='text/plain')
+
+
+async def maintain_partitions(app):
+    # Blocking psycopg2 work, so it runs on its own thread rather than the event loop
+    start_partition_maintenance()
+
+
+async def close_pool(app):
+    await app['pool'].close()
+
+
+def create_app():
+    app = web.Application()
+    app.on_startup.append(open_pool)
+    app.on_startup.append(maintain_partitions)
+    app.on_startup.append(start_live)
+    app.on_cleanup.append(stop_live)
+    app.on_cleanup.append(close_pool)
+    app.router.add_get('/api/returns', list_returns)
+    app.router.add_post('/api/returns', create_return)
+    app.router.add_get('/api/returns/{return_id:\\d+}', get_return)
+    app.router.add_post('/api/returns/{return_id:\\d+}', update_return)
+    app.router.add_get('/api/sellers', list_sellers)
+    app.router.add_get('/api/customers', list_customers)
+    app.router.add_get('/api/exports/{job_id}/download', export_download)
+    app.router.add_get('/admin/events', admin_events)
+    app.router.add_get('/metrics', metrics)
+    return app
+
+
+if __name__ == '__main__':
+    print("Starting async Returns API")
+    web.run_app(create_app(), host='0.0.0.0', port=int(os.environ.get('ASYNC_API_PORT', '5001')))
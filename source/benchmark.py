@@ -0,0 +1,415 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+import random
+import argparse
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, date
+
+# Seeds the database at fixed scales and records route latency and exporter cost as JSON,
+# so two commits can be compared with --baseline. Seeding DROPS and recreates the schema.
+
+SCALES = [1000, 100000, 1000000]
+ROUTES = ['get_admin', 'get_returns', 'post_returns', 'post_update_return']
+EXPORT_MODES = ['batch', 'stream']
+ROW_TYPES = ['dict', 'record']
+PERCENTILES = [50, 90, 95, 99]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_stats(latencies, wall_seconds, errors):
+    ordered = sorted(latencies)
+    stats = {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput_rps': len(ordered) / wall_seconds if wall_seconds else None,
+        'mean_ms': statistics.fmean(ordered) * 1000 if ordered else None,
+        'max_ms': ordered[-1] * 1000 if ordered else None
+    }
+    for pct in PERCENTILES:
+        value = percentile(ordered, pct)
+        stats[f'p{pct}_ms'] = value * 1000 if value is not None else None
+    return stats
+
+
+def seller_and_customer_ids():
+    from database import get_db
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT id FROM users WHERE user_type = 'seller' ORDER BY id")
+        sellers = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT MIN(id), MAX(id) FROM customers")
+        customer_range = cur.fetchone()
+        cur.execute("SELECT MIN(id), MAX(id) FROM returns")
+        return_range = cur.fetchone()
+        return sellers, customer_range, return_range
+    finally:
+        cur.close()
+        conn.close()
+
+
+def build_requests(route, count, rng):
+    sellers, customer_range, return_range = seller_and_customer_ids()
+    requests = []
+    for _ in range(count):
+        if route == 'get_admin':
+            requests.append(('GET', '/admin', None))
+        elif route == 'get_returns':
+            requests.append(('GET', '/returns', None))
+        elif route == 'post_returns':
+            requests.append(('POST', '/returns', {
+                'seller_id': rng.choice(sellers),
+                'customer_id': rng.randint(*customer_range),
+                'purchase_date': date(2024, 1, 1).isoformat(),
+                'product_name': 'Benchmark item',
+                'reason': 'Benchmark run'
+            }))
+        elif route == 'post_update_return':
+            requests.append(('POST', f'/update_return/{rng.randint(*return_range)}', {
+                'status': rng.choice(['approved', 'rejected']),
+                'comment': 'Benchmark run'
+            }))
+    return requests
+
+
+class InProcessClient:
+    # Flask test client: no sockets, so the numbers are application and database time only
+
+    def __init__(self, warm):
+        from app import app
+        from cache import page_cache
+
+        self.app = app
+        self.page_cache = page_cache
+        self.warm = warm
+        self._local = threading.local()
+
+    def send(self, method, path, form):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client(use_cookies=False)
+        if not self.warm:
+            self.page_cache.clear()
+        response = client.open(path, method=method, data=form)
+        response.close()
+        return response.status_code < 400
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, method, path, form):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status < 400
+        except urllib.error.HTTPError:
+            return False
+
+
+def run_route(client, requests, concurrency, warmup):
+    for method, path, form in requests[:warmup]:
+        client.send(method, path, form)
+
+    pending = iter(requests[warmup:])
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def worker():
+        while True:
+            with lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                ok = client.send(*item)
+            except Exception as e:
+                print(f"Request error: {e}")
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latency_stats(latencies, time.perf_counter() - started, errors[0])
+
+
+def max_rss_bytes(rusage):
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+
+
+def run_export(format_name, mode, fetch_size):
+    # One process per run so ru_maxrss is that export's own peak
+    output_dir = tempfile.mkdtemp(prefix='bench_export_')
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export_data.py'),
+               'returns', '--formats', format_name, '--output-dir', output_dir, '--fetch-size', str(fetch_size)]
+    if mode == 'stream':
+        command.append('--stream')
+
+    try:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_seconds = time.perf_counter() - started
+        output_bytes = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+        return {
+            'exit_code': os.waitstatus_to_exitcode(status),
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+            'peak_rss_bytes': max_rss_bytes(rusage),
+            'output_bytes': output_bytes
+        }
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def measure_fetch(cursor_factory, sql, params, repeats):
+    # Python heap held by one fully fetched result, and the median time to execute and fetch it
+    from database import get_db
+
+    conn = get_db(readonly=True)
+    try:
+        timings = []
+        for _ in range(repeats):
+            cur = conn.cursor(cursor_factory=cursor_factory)
+            started = time.perf_counter()
+            cur.execute(sql, params)
+            cur.fetchall()
+            timings.append(time.perf_counter() - started)
+            cur.close()
+
+        # Traced separately: tracemalloc slows allocation-heavy code several times over
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        cur.execute(sql, params)
+        tracemalloc.start()
+        rows = cur.fetchall()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del rows
+        cur.close()
+        return {'median_ms': statistics.median(timings) * 1000, 'peak_bytes': peak}
+    finally:
+        conn.close()
+
+
+def measure_listing(prepared, repeats):
+    # First page of the admin listing, the query every listing request runs
+    from database import get_db
+    from queries import PAGE_SIZE, execute_prepared, returns_page_query
+    from records import RecordCursor
+
+    conn = get_db(readonly=True)
+    try:
+        cur = conn.cursor(cursor_factory=RecordCursor)
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            if prepared:
+                execute_prepared(cur, *returns_page_query({}, None, PAGE_SIZE))
+            else:
+                cur.execute(*returns_page_query({}, None, PAGE_SIZE))
+            cur.fetchall()
+            timings.append(time.perf_counter() - started)
+        cur.close()
+        return {'median_ms': statistics.median(timings[1:] or timings) * 1000}
+    finally:
+        conn.close()
+
+
+def run_rows(row_limit, repeats):
+    import psycopg2.extras
+    from queries import RETURNS_SELECT
+    from records import RecordCursor
+
+    result = {}
+    sql = RETURNS_SELECT + ' ORDER BY r.id LIMIT %s'
+    for row_type, factory in zip(ROW_TYPES, (psycopg2.extras.RealDictCursor, RecordCursor)):
+        result[f'fetch/{row_type}'] = stats = measure_fetch(factory, sql, (row_limit,), repeats)
+        print(f"  fetch {row_limit} rows as {row_type:<7} {stats['median_ms']:8.2f} ms  "
+              f"heap {stats['peak_bytes'] / 1048576:8.1f} MiB")
+    for mode in ('unprepared', 'prepared'):
+        result[f'listing/{mode}'] = stats = measure_listing(mode == 'prepared', repeats * 20)
+        print(f"  listing page {mode:<10} {stats['median_ms']:8.3f} ms")
+    return result
+
+
+def seed_scale(returns, seed):
+    from init_db import init_db
+
+    # Sellers and customers grow with the scale so joins and the customer typeahead stay realistic
+    init_db(sellers=max(10, returns // 10000), customers=max(1000, returns // 20), returns=returns, seed=seed)
+
+
+def database_version():
+    from database import get_db
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('SHOW server_version')
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scale(args, scale):
+    result = {'scale': scale, 'routes': {}, 'exports': {}, 'rows': {}}
+    client = HttpClient(args.url) if args.url else InProcessClient(args.warm)
+    rng = random.Random(args.seed)
+
+    for route in args.routes:
+        requests = build_requests(route, args.requests + args.warmup, rng)
+        stats = run_route(client, requests, args.concurrency, args.warmup)
+        result['routes'][route] = stats
+        print(f"  {route:<20} p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+              f"p99 {stats['p99_ms']:8.2f} ms  {stats['throughput_rps']:8.1f} req/s  errors {stats['errors']}")
+
+    for mode in args.export_modes:
+        for format_name in args.formats:
+            stats = run_export(format_name, mode, args.fetch_size)
+            result['exports'][f'{format_name}/{mode}'] = stats
+            print(f"  export {format_name:<8} {mode:<6} {stats['wall_seconds']:8.2f} s  "
+                  f"peak RSS {stats['peak_rss_bytes'] / 1048576:8.1f} MiB  exit {stats['exit_code']}")
+
+    if args.row_limit:
+        result['rows'] = run_rows(args.row_limit, args.row_repeats)
+    return result
+
+
+def change(current, previous):
+    if current is None or not previous:
+        return ''
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def compare(results, baseline):
+    previous_scales = {str(entry['scale']): entry for entry in baseline['scales']}
+    print(f"Compared with {baseline.get('commit') or 'baseline'} ({baseline.get('started_at')})")
+    for entry in results['scales']:
+        previous = previous_scales.get(str(entry['scale']))
+        if previous is None:
+            continue
+        print(f"scale {entry['scale']}")
+        for route, stats in entry['routes'].items():
+            old = previous['routes'].get(route)
+            if old:
+                print(f"  {route:<20} p50 {change(stats['p50_ms'], old['p50_ms']):>8}  "
+                      f"p95 {change(stats['p95_ms'], old['p95_ms']):>8}  "
+                      f"throughput {change(stats['throughput_rps'], old['throughput_rps']):>8}")
+        for name, stats in entry['exports'].items():
+            old = previous['exports'].get(name)
+            if old:
+                print(f"  export {name:<15} wall {change(stats['wall_seconds'], old['wall_seconds']):>8}  "
+                      f"peak RSS {change(stats['peak_rss_bytes'], old['peak_rss_bytes']):>8}")
+        for name, stats in entry.get('rows', {}).items():
+            old = previous.get('rows', {}).get(name)
+            if old:
+                print(f"  {name:<22} time {change(stats['median_ms'], old['median_ms']):>8}  "
+                      f"heap {change(stats.get('peak_bytes'), old.get('peak_bytes')):>8}")
+
+
+def comma_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main():
+    from export_data import FORMATS, WRITERS
+
+    parser = argparse.ArgumentParser(description='Benchmark the web routes and the exporter at several data scales')
+    parser.add_argument('--scales', type=lambda value: [int(item) for item in comma_list(value)], default=SCALES,
+                        help='comma-separated numbers of synthetic returns; the schema is dropped and reseeded '
+                             'for each one')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='benchmark whatever the database currently holds instead of reseeding')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--routes', type=comma_list, default=ROUTES, help=f"from {', '.join(ROUTES)}")
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process test client')
+    parser.add_argument('--warm', action='store_true',
+                        help='keep the rendered page cache between requests (in-process only)')
+    parser.add_argument('--formats', type=comma_list, default=FORMATS, help=f"from {', '.join(WRITERS)}")
+    parser.add_argument('--export-modes', type=comma_list, default=EXPORT_MODES)
+    parser.add_argument('--fetch-size', type=int, default=1000)
+    parser.add_argument('--row-limit', type=int, default=100000,
+                        help='rows fetched as dicts and as records to compare heap and fetch time; 0 skips it')
+    parser.add_argument('--row-repeats', type=int, default=3)
+    parser.add_argument('--output', default=f"benchmark_{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    parser.add_argument('--baseline', help='earlier results file to print relative changes against')
+    args = parser.parse_args()
+
+    unknown = [route for route in args.routes if route not in ROUTES]
+    unknown += [name for name in args.formats if name not in WRITERS]
+    unknown += [mode for mode in args.export_modes if mode not in EXPORT_MODES]
+    if unknown:
+        parser.error(f"unknown: {', '.join(unknown)}")
+
+    results = {
+        'commit': git_commit(),
+        'started_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'scales': []
+    }
+
+    for scale in (['current'] if args.no_seed else args.scales):
+        if scale != 'current':
+            print(f"Seeding {scale} returns")
+            seed_scale(scale, args.seed)
+        results.setdefault('postgres', database_version())
+        print(f"Scale {scale}")
+        results['scales'].append(run_scale(args, scale))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
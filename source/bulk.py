@@ -0,0 +1,138 @@
+import csv
+import io
+from datetime import date
+from psycopg2.extras import execute_values
+from database import get_db
+
+MAX_BULK_ITEMS = 5000
+RETURN_FIELDS = ('seller_id', 'customer_id', 'purchase_date', 'product_name', 'reason')
+STATUSES = ('pending', 'approved', 'rejected')
+
+
+def parse_csv_items(text):
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def validate_return_item(item):
+    if not isinstance(item, dict):
+        return None, 'expected an object'
+
+    missing = [field for field in RETURN_FIELDS if item.get(field) in (None, '')]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+
+    try:
+        seller_id = int(item['seller_id'])
+        customer_id = int(item['customer_id'])
+    except (TypeError, ValueError):
+        return None, 'seller_id and customer_id must be integers'
+
+    try:
+        purchase_date = date.fromisoformat(str(item['purchase_date']))
+    except ValueError:
+        return None, 'purchase_date must be YYYY-MM-DD'
+
+    product_name = str(item['product_name']).strip()
+    if len(product_name) > 100:
+        return None, 'product_name is longer than 100 characters'
+
+    return (seller_id, customer_id, purchase_date, product_name, str(item['reason'])), None
+
+
+def existing_ids(cur, query, ids):
+    cur.execute(query, (list(ids),))
+    return {row[0] for row in cur.fetchall()}
+
+
+def create_returns_bulk(items):
+    # Validate everything up front so one bad row is reported instead of aborting the whole insert
+    errors = []
+    valid = []
+    for index, item in enumerate(items):
+        row, error = validate_return_item(item)
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            valid.append((index, row))
+
+    if not valid:
+        return [], errors
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        sellers = existing_ids(cur, "SELECT id FROM users WHERE user_type = 'seller' AND id = ANY(%s)",
+                               {row[0] for _, row in valid})
+        customers = existing_ids(cur, "SELECT id FROM customers WHERE id = ANY(%s)",
+                                 {row[1] for _, row in valid})
+
+        rows = []
+        indexes = []
+        for index, row in valid:
+            if row[0] not in sellers:
+                errors.append({'index': index, 'error': f"unknown seller_id {row[0]}"})
+            elif row[1] not in customers:
+                errors.append({'index': index, 'error': f"unknown customer_id {row[1]}"})
+            else:
+                rows.append(row)
+                indexes.append(index)
+
+        created = []
+        if rows:
+            # One multi-row INSERT; RETURNING comes back in VALUES order
+            ids = execute_values(cur, '''
+                                      INSERT INTO returns
+                                          (seller_id, customer_id, purchase_date, product_name, reason)
+                                      VALUES %s
+                                      RETURNING id
+                                      ''', rows, page_size=len(rows), fetch=True)
+            created = [{'index': index, 'id': row[0]} for index, row in zip(indexes, ids)]
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    errors.sort(key=lambda error: error['index'])
+    return created, errors
+
+
+def update_return_status_bulk(return_ids, status, comment, admin_id):
+    if status not in STATUSES:
+        raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+    if comment is not None and not isinstance(comment, str):
+        raise ValueError('comment must be a string')
+
+    ids = []
+    errors = []
+    for return_id in return_ids:
+        try:
+            ids.append(int(return_id))
+        except (TypeError, ValueError):
+            errors.append({'id': return_id, 'error': 'not an integer'})
+
+    updated = set()
+    if ids:
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            cur.execute('''
+                        UPDATE returns
+                        SET status = %s, comment = %s, admin_id = %s, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ANY(%s)
+                        RETURNING id
+                        ''', (status, comment, admin_id, ids))
+            updated = {row[0] for row in cur.fetchall()}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+    errors.extend({'id': return_id, 'error': 'not found'} for return_id in ids if return_id not in updated)
+    return sorted(updated), errors
@@ -0,0 +1,174 @@
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+LOOKUP_CACHE_TTL = float(os.environ.get('LOOKUP_CACHE_TTL', '60'))
+LOOKUP_CACHE_SIZE = int(os.environ.get('LOOKUP_CACHE_SIZE', '128'))
+REDIS_URL = os.environ.get('REDIS_URL')
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', '300'))
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', '256'))
+
+
+class RedisBackend:
+    # Shared tier: values stored as JSON next to a generation counter per key. invalidate() bumps the
+    # counter, and every worker compares it before trusting its own copy, so an invalidation from any
+    # process (the seeding CLIs included) reaches them all
+
+    def __init__(self, url, prefix='returns:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value, default=str), ex=max(int(ttl), 1))
+
+    def generation(self, key):
+        return int(self.client.get(self.prefix + 'generation:' + key) or 0)
+
+    def bump(self, *keys):
+        pipeline = self.client.pipeline()
+        for key in keys:
+            pipeline.incr(self.prefix + 'generation:' + key)
+        pipeline.delete(*[self.prefix + key for key in keys])
+        pipeline.execute()
+
+
+class LookupCache:
+    def __init__(self, ttl=LOOKUP_CACHE_TTL, max_entries=LOOKUP_CACHE_SIZE, backend=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries = OrderedDict()  # key -> (expires_at, value, generation), least recently used first
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        # None without a shared tier (or while it is unreachable): local entries then only expire by TTL
+        generation = self._get_generation(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now and entry[2] == generation:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        shared = self._get_shared(key)
+        # A value loaded before the last invalidation carries the old generation and is ignored
+        if shared is not None and shared.get('generation') == generation:
+            value = shared['value']
+            with self._lock:
+                self.shared_hits += 1
+        else:
+            with self._lock:
+                self.misses += 1
+            # Loader errors propagate and nothing is cached, so a failed query is retried next time
+            value = loader()
+            self._set_shared(key, {'generation': generation, 'value': value})
+
+        self._store(key, value, now, generation)
+        return value
+
+    def _store(self, key, value, now, generation):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _get_generation(self, key):
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.generation(key)
+        except Exception as e:
+            print(f"Shared cache error: {e}")
+            return None
+
+    def _get_shared(self, key):
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            print(f"Shared cache error: {e}")
+            return None
+
+    def _set_shared(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            print(f"Shared cache error: {e}")
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += 1
+        if self.backend is not None:
+            try:
+                self.backend.bump(*keys)
+            except Exception as e:
+                print(f"Shared cache error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits_total': self.hits,
+                'shared_hits_total': self.shared_hits,
+                'misses_total': self.misses,
+                'evictions_total': self.evictions,
+                'invalidations_total': self.invalidations
+            }
+
+
+def make_lookup_cache():
+    backend = None
+    if REDIS_URL and redis is not None:
+        backend = RedisBackend(REDIS_URL)
+    return LookupCache(backend=backend)
+
+
+lookup_cache = make_lookup_cache()
+
+# Rendered listing pages keyed by their ETag; a data change produces a new key, TTL only bounds staleness
+# of things the version token does not cover (seller names, the sellers dropdown)
+page_cache = LookupCache(ttl=PAGE_CACHE_TTL, max_entries=PAGE_CACHE_SIZE)
+
+
+def invalidate_lookups():
+    # Call after changing users. Reaches the web workers only through REDIS_URL; without it their
+    # copies are stale for at most LOOKUP_CACHE_TTL
+    lookup_cache.invalidate('sellers')
+
+
+def cache_metrics():
+    lines = []
+    for prefix, cache in (('lookup_cache', lookup_cache), ('page_cache', page_cache)):
+        for key, value in cache.stats().items():
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,12 +1,447 @@
+import os
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from flask import g, has_app_context, has_request_context, session
+from instrumentation import TimedCursor, record_phase
 
-def get_db():
-    conn = psycopg2.connect(
-        host='postgres',
-        database='return_management',
-        user='postgres',
-        password='password',
-        port='5432'
-    )
-    return conn
\ No newline at end of file
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'postgres'),
+    'database': os.environ.get('DB_NAME', 'return_management'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', 'password'),
+    'port': os.environ.get('DB_PORT', '5432')
+}
+
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', '30'))
+POOL_HEALTH_CHECK_AFTER = float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', '5'))
+
+# Comma-separated host[:port] list; the other connection settings are shared with the primary
+REPLICA_HOSTS = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+REPLICA_RETRY_AFTER = float(os.environ.get('DB_REPLICA_RETRY_AFTER', '30'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '10'))
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '30'))
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', '5'))
+PREPARE_STATEMENTS = os.environ.get('DB_PREPARE_STATEMENTS', '1') == '1'
+PREPARED_STATEMENTS_MAX = int(os.environ.get('DB_PREPARED_STATEMENTS_MAX', '32'))
+
+# Caught up when everything received has been replayed; NULL (and so 0) on a primary
+REPLICA_LAG_SQL = '''
+                  SELECT CASE
+                      WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                      ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                  END
+                  '''
+
+
+class Connection(extensions.connection):
+    # Remembers the statements PREPAREd on this session: SQL text -> statement name, least recently
+    # used first, capped at PREPARED_STATEMENTS_MAX
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+        self.statements = 0
+
+
+def connect(config=DB_CONFIG):
+    return psycopg2.connect(connection_factory=Connection, **config)
+
+
+def replica_config(address):
+    host, _, port = address.partition(':')
+    return dict(DB_CONFIG, host=host, port=port or DB_CONFIG['port'])
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    # Behaves like a psycopg2 connection, but close() hands it back to the pool
+
+    def __init__(self, pool, conn, scoped=False, readonly=False):
+        self._pool = pool
+        self._conn = conn
+        self._scoped = scoped
+        self._readonly = readonly
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def commit(self):
+        self._conn.commit()
+        if self._scoped and not self._readonly:
+            # Reads for the rest of this request, and the next one, go to the primary
+            g._db_wrote = True
+
+    def close(self):
+        # Request-scoped connections are released in teardown_appcontext
+        if self._scoped or self._conn is None:
+            return
+        self.release()
+
+    def release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.putconn(conn)
+
+
+class ConnectionPool:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER, connect_func=connect):
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.connect_func = connect_func
+
+        self._lock = threading.Condition()
+        self._idle = []  # list of (conn, released_at), most recently used last
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.health_check_failures = 0
+        self.checkout_seconds_total = 0.0
+        self.checkout_seconds_max = 0.0
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+
+        with self._lock:
+            self._close_expired()
+            while True:
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._size < self.max_size:
+                    conn, released_at = None, None
+                    self._size += 1
+                    self._in_use += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No free connection after {self.checkout_timeout}s")
+                self._waiting += 1
+                try:
+                    self._lock.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn, released_at):
+                self.health_check_failures += 1
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self.connect_func()
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds_total += elapsed
+            self.checkout_seconds_max = max(self.checkout_seconds_max, elapsed)
+        return conn
+
+    def putconn(self, conn):
+        keep = not conn.closed
+        if keep:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                keep = False
+
+        with self._lock:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._lock.notify()
+
+        if not keep:
+            self._close_quietly(conn)
+
+    def _is_healthy(self, conn, released_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close_expired(self):
+        # Called with the lock held; oldest idle connections sit at the front
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'max_size': self.max_size,
+                'min_size': self.min_size,
+                'checkouts_total': self.checkouts,
+                'checkout_timeouts_total': self.timeouts,
+                'health_check_failures_total': self.health_check_failures,
+                'checkout_seconds_total': self.checkout_seconds_total,
+                'checkout_seconds_max': self.checkout_seconds_max
+            }
+
+
+class Replica:
+    def __init__(self, address):
+        self.address = address
+        self.pool = ConnectionPool(connect_func=partial(connect, replica_config(address)))
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        self.lag_seconds = 0.0
+        self.failures = 0
+
+    def available(self, now):
+        return self.down_until <= now
+
+    def mark_down(self, reason):
+        print(f"Replica {self.address} unavailable, using other servers for {REPLICA_RETRY_AFTER}s: {reason}")
+        self.down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        self.failures += 1
+
+    def check_lag(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(REPLICA_LAG_SQL)
+            self.lag_seconds = float(cur.fetchone()[0])
+        finally:
+            cur.close()
+            conn.rollback()
+        self.checked_at = time.monotonic()
+        return self.lag_seconds <= REPLICA_MAX_LAG
+
+    def getconn(self):
+        conn = self.pool.getconn()
+        try:
+            if time.monotonic() - self.checked_at < REPLICA_CHECK_INTERVAL or self.check_lag(conn):
+                return conn
+            reason = f"replication lag {self.lag_seconds:.1f}s"
+        except Exception as e:
+            reason = e
+        self.pool.putconn(conn)
+        self.mark_down(reason)
+        return None
+
+
+class ReplicaRouter:
+    # Round-robin over the replicas that are up; None means fall back to the primary
+
+    def __init__(self, addresses):
+        self.replicas = [Replica(address) for address in addresses]
+        self._counter = itertools.count()
+        self.fallbacks = 0
+
+    def getconn(self):
+        now = time.monotonic()
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if not replica.available(now):
+                continue
+            try:
+                conn = replica.getconn()
+            except PoolTimeout:
+                continue
+            except Exception as e:
+                replica.mark_down(e)
+                continue
+            if conn is not None:
+                return replica, conn
+        self.fallbacks += 1
+        return None, None
+
+    def closeall(self):
+        for replica in self.replicas:
+            replica.pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_replicas():
+    global _replicas
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                _replicas = ReplicaRouter(REPLICA_HOSTS)
+    return _replicas
+
+
+def checkout(pool):
+    started = time.perf_counter()
+    try:
+        return pool.getconn()
+    finally:
+        record_phase('connect', time.perf_counter() - started)
+
+
+def open_primary(scoped):
+    pool = get_pool()
+    return PooledConnection(pool, checkout(pool), scoped=scoped)
+
+
+def open_replica(scoped):
+    started = time.perf_counter()
+    replica, conn = get_replicas().getconn()
+    record_phase('connect', time.perf_counter() - started)
+    if conn is None:
+        return None
+    return PooledConnection(replica.pool, conn, scoped=scoped, readonly=True)
+
+
+def scoped_connection(key, open_connection):
+    conn = g.get(key)
+    if conn is None or conn.raw is None:
+        conn = open_connection(scoped=True)
+        if conn is not None:
+            setattr(g, key, conn)
+    elif conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+        # A previous helper in this request failed without rolling back
+        conn.rollback()
+    return conn
+
+
+def primary_required():
+    # Read-your-writes: after a write, this request and the one it redirects to read from the primary
+    if not has_app_context():
+        return False
+    if g.get('_db_wrote'):
+        return True
+    return has_request_context() and time.time() - session.get('_db_wrote_at', 0) < READ_YOUR_WRITES_SECONDS
+
+
+def get_db(readonly=False):
+    # readonly=True may be served by a replica, so only pass it for queries that never write
+    if readonly and REPLICA_HOSTS and not primary_required():
+        if not has_app_context():
+            conn = open_replica(scoped=False)
+        else:
+            conn = scoped_connection('_db_replica_conn', open_replica)
+        if conn is not None:
+            return conn
+
+    if not has_app_context():
+        return open_primary(scoped=False)
+    return scoped_connection('_db_conn', open_primary)
+
+
+def release_db(exception=None):
+    for key in ('_db_conn', '_db_replica_conn'):
+        conn = g.pop(key, None)
+        if conn is not None:
+            conn.release()
+
+
+def remember_write(response):
+    if REPLICA_HOSTS and g.get('_db_wrote'):
+        session['_db_wrote_at'] = time.time()
+    return response
+
+
+def init_app(app):
+    app.after_request(remember_write)
+    app.teardown_appcontext(release_db)
+
+
+def pool_metrics():
+    stats = get_pool().stats()
+    lines = []
+    for key, value in stats.items():
+        lines.append(f"db_pool_{key} {value}")
+
+    if REPLICA_HOSTS:
+        router = get_replicas()
+        now = time.monotonic()
+        lines.append(f"db_replica_fallbacks_total {router.fallbacks}")
+        for replica in router.replicas:
+            label = f'{{replica="{replica.address}"}}'
+            lines.append(f"db_replica_up{label} {int(replica.available(now))}")
+            lines.append(f"db_replica_lag_seconds{label} {replica.lag_seconds}")
+            lines.append(f"db_replica_failures_total{label} {replica.failures}")
+            for key, value in replica.pool.stats().items():
+                lines.append(f"db_replica_pool_{key}{label} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,16 +1,436 @@
 import os
+import sys
+import argparse
+import fcntl
+import gzip
+import queue
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import json
 import csv
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
 import yaml
 from database import get_db
-import psycopg2.extras
+from instrumentation import finish_profile, start_profile
+from migrations import RETURN_SEARCH_CONFIG
+from partitions import RETURN_COLUMNS
+from queries import build_returns_where
+from records import RecordCursor, record_type, serializable_record
 from datetime import datetime, date
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+
+def copy_bytes(src, dst, start, end, chunk_size=1024 * 1024):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def open_compressed(filename, mode, compression, **kwargs):
+    if compression == 'gzip':
+        return gzip.open(filename, mode, **kwargs)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        return zstandard.open(filename, mode, **kwargs)
+    return open(filename, mode, **kwargs)
+
+
+class ExportWriter:
+    # Writes records one at a time; the file is only created once a record arrives
+    extension = None
+    native_types = False
+
+    def __init__(self, output_dir, table_name, basename='data', compression=None, batch_size=1000):
+        self.compression = compression
+        self.filename = os.path.join(output_dir, f"{basename}.{self.extension}")
+        if compression and not self.native_types:
+            self.filename += COMPRESSION_SUFFIXES[compression]
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.file = None
+        self.count = 0
+
+    def open(self):
+        return open_compressed(self.filename, 'wt', self.compression, encoding='utf-8')
+
+    def open_binary(self):
+        return open_compressed(self.filename, 'wb', self.compression)
+
+    def write_row(self, record, serializable, relations):
+        self.write(record if self.native_types else serializable, relations)
+
+    def write(self, record, relations=None):
+        if self.file is None:
+            self.file = self.open()
+            self.write_header(record)
+        self.write_record(record, relations)
+        self.count += 1
+
+    def close(self):
+        if self.file is None:
+            return False
+        self.write_footer()
+        self.file.close()
+        self.file = None
+        return True
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write_header(self, record):
+        pass
+
+    def write_empty(self, columns):
+        # Header and footer only, so an export that matched nothing is still a valid file
+        self.file = self.open()
+        self.write_header(record_type(tuple(columns))._make([None] * len(columns)))
+
+    def write_record(self, record, relations):
+        raise NotImplementedError
+
+    def write_footer(self):
+        pass
+
+    def merge(self, part_filenames):
+        # Stitch complete per-partition files into one file, byte for byte as a single run would write it
+        with self.open_binary() as out:
+            for index, part_filename in enumerate(part_filenames):
+                with open(part_filename, 'rb') as part:
+                    self.merge_part(part, out, os.path.getsize(part_filename), index == 0)
+            self.merge_footer(out, bool(part_filenames))
+
+    def merge_part(self, part, out, size, first):
+        copy_bytes(part, out, 0, size)
+
+    def merge_footer(self, out, merged):
+        pass
+
+
+class JsonWriter(ExportWriter):
+    extension = 'json'
+
+    def write_header(self, record):
+        self.file.write('[')
+
+    def write_record(self, record, relations):
+        record_dict = dict(record.items())
+
+        if relations:
+            record_dict['seller'] = relations['seller']
+            record_dict['customer'] = relations['customer']
+            if relations['admin']:
+                record_dict['admin'] = relations['admin']
+
+            keys_to_remove = ['seller_name', 'customer_first_name',
+                              'customer_last_name', 'customer_email', 'admin_name']
+            for key in keys_to_remove:
+                record_dict.pop(key, None)
+
+        # Same layout json.dump(indent=2) gives the whole list
+        separator = ',\n  ' if self.count else '\n  '
+        self.file.write(separator + json.dumps(record_dict, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+
+    def write_footer(self):
+        self.file.write('\n]' if self.count else ']')
+
+    def merge_part(self, part, out, size, first):
+        out.write(b'[' if first else b',')
+        copy_bytes(part, out, 1, size - 2)
+
+    def merge_footer(self, out, merged):
+        if merged:
+            out.write(b'\n]')
+
+
+class CsvWriter(ExportWriter):
+    extension = 'csv'
+
+    def open(self):
+        return open_compressed(self.filename, 'wt', self.compression, newline='', encoding='utf-8')
+
+    def write_header(self, record):
+        fieldnames = list(record.keys())
+
+        if self.table_name == 'returns':
+            fieldnames = [f for f in fieldnames if not f.endswith('_id')]
+            fieldnames.extend(['seller_name', 'customer_name', 'admin_name'])
+
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        self.writer.writeheader()
+
+    def write_record(self, record, relations):
+        row_data = dict(record.items())
+
+        if relations:
+            row_data['seller_name'] = relations['seller']['name']
+            row_data['customer_name'] = relations['customer_name']
+            row_data['admin_name'] = relations['admin_name']
+
+            for key in ['seller_id', 'customer_id', 'admin_id',
+                        'seller_name', 'customer_first_name',
+                        'customer_last_name', 'admin_name']:
+                row_data.pop(key, None)
+
+        self.writer.writerow(row_data)
+
+    def merge_part(self, part, out, size, first):
+        header = part.readline()
+        if first:
+            out.write(header)
+        copy_bytes(part, out, len(header), size)
+
+
+class XmlWriter(ExportWriter):
+    extension = 'xml'
+
+    def write_header(self, record):
+        self.file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        self.file.write(f"<data table={quoteattr(self.table_name)} exported={quoteattr(datetime.now().isoformat())}>")
+
+    def write_record(self, record, relations):
+        record_element = ET.Element('record')
+
+        for key, value in record.items():
+            if value is None:
+                continue
+
+            element = ET.SubElement(record_element, key)
+
+            if relations and key in ['seller_id', 'customer_id', 'admin_id']:
+                element.set('id', str(value))
+                if key == 'seller_id':
+                    element.set('name', relations['seller']['name'])
+                elif key == 'customer_id':
+                    element.set('name', relations['customer_name'])
+                elif key == 'admin_id' and relations['admin'] and relations['admin']['name']:
+                    element.set('name', relations['admin']['name'])
+            else:
+                element.text = str(value)
+
+        self.file.write(ET.tostring(record_element, encoding='unicode'))
+
+    def write_footer(self):
+        self.file.write('</data>')
+
+    def merge_part(self, part, out, size, first):
+        # Declaration and <data ...> opening tag; records follow on the same line
+        head = part.read(4096)
+        start = head.index(b'>', head.index(b'?>') + 2) + 1
+        if first:
+            out.write(head[:start])
+        copy_bytes(part, out, start, size - len(b'</data>'))
+
+    def merge_footer(self, out, merged):
+        if merged:
+            out.write(b'</data>')
+
+
+class YamlWriter(ExportWriter):
+    extension = 'yaml'
+
+    def write_record(self, record, relations):
+        record_dict = dict(record.items())
+
+        if relations:
+            record_dict['relationships'] = {
+                'seller': relations['seller'],
+                'customer': relations['customer']
+            }
+            if relations['admin']:
+                record_dict['relationships']['admin'] = relations['admin']
+
+        # A block-style list dumps as the concatenation of its one-item dumps
+        yaml.dump([record_dict], self.file, default_flow_style=False, allow_unicode=True)
+
+    def write_footer(self):
+        if not self.count:
+            self.file.write('[]\n')
+
+
+def arrow_type(column):
+    if column == 'id' or column.endswith('_id'):
+        return pa.int32()
+    if column.endswith('_date'):
+        return pa.date32()
+    if column.endswith('_at'):
+        return pa.timestamp('us')
+    return pa.string()
+
+
+class ColumnarWriter(ExportWriter):
+    # Buffers batch_size rows and writes them as one Arrow record batch with native column types
+    native_types = True
+
+    def open_sink(self, schema):
+        raise NotImplementedError
+
+    def write_header(self, record):
+        if pa is None:
+            raise RuntimeError(f"{self.extension} export requires the pyarrow package")
+        self.schema = pa.schema([(column, arrow_type(column)) for column in record.keys()])
+        self.sink = self.open_sink(self.schema)
+        self.rows = []
+
+    def open(self):
+        return True
+
+    def write_record(self, record, relations):
+        self.rows.append(record)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Rows are transposed into one array per column; no per-row dicts on the way to Arrow
+        if self.rows:
+            columns = zip(*[tuple(row.values()) for row in self.rows])
+            arrays = [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)]
+            self.sink.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+            self.rows = []
+
+    def write_footer(self):
+        self.flush()
+
+    def close(self):
+        if self.file is None:
+            return False
+        self.write_footer()
+        self.sink.close()
+        self.file = None
+        return True
+
+    def abort(self):
+        if self.file is not None:
+            self.sink.close()
+            self.file = None
+
+    def merge(self, part_filenames):
+        sink = None
+        for part_filename in part_filenames:
+            for batch in self.read_batches(part_filename):
+                if sink is None:
+                    sink = self.open_sink(batch.schema)
+                sink.write_batch(batch)
+        if sink is not None:
+            sink.close()
+
+    def read_batches(self, filename):
+        raise NotImplementedError
+
+
+class ParquetWriter(ColumnarWriter):
+    extension = 'parquet'
+
+    def open_sink(self, schema):
+        return pq.ParquetWriter(self.filename, schema, compression=self.compression or 'snappy')
+
+    def read_batches(self, filename):
+        return pq.ParquetFile(filename).iter_batches(batch_size=self.batch_size)
+
+
+class ArrowWriter(ColumnarWriter):
+    extension = 'arrow'
+
+    def open_sink(self, schema):
+        # The IPC format only supports lz4 and zstd buffer compression
+        options = pa.ipc.IpcWriteOptions(compression='zstd' if self.compression == 'zstd' else None)
+        return pa.ipc.new_file(self.filename, schema, options=options)
+
+    def read_batches(self, filename):
+        with pa.memory_map(filename) as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                yield reader.get_batch(index)
+
+
+WRITERS = {
+    'json': JsonWriter,
+    'csv': CsvWriter,
+    'xml': XmlWriter,
+    'yaml': YamlWriter,
+    'parquet': ParquetWriter,
+    'arrow': ArrowWriter
+}
+
+# Text formats written when no format list is given
+FORMATS = ['json', 'csv', 'xml', 'yaml']
+
+# Column that moves forward whenever a row changes, used for incremental exports
+CHANGE_COLUMNS = {
+    'returns': 'updated_at',
+    'returns_archive': 'archived_at',
+    'users': 'created_at',
+    'customers': 'created_at'
+}
+
+STATE_FILE = 'export_state.json'
+LOCK_FILE = '.export.lock'
+
+
+class WriterThread(threading.Thread):
+    # Feeds one writer from a bounded queue so a slow format only stalls the reader when its queue fills
+
+    def __init__(self, writer, queue_size):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    self.writer.write_row(*item)
+                except Exception as e:
+                    # Keep draining so the reader never blocks on a dead writer
+                    self.error = e
+
+
 class DataExporter:
-    def __init__(self, table_name, output_dir="out"):
+    def __init__(self, table_name, output_dir="out", stream=False, fetch_size=1000,
+                 incremental=False, settle_seconds=60, id_range=None, compression=None, filters=None):
         self.table_name = table_name
         self.output_dir = output_dir
+        self.stream = stream
+        self.fetch_size = fetch_size
+        self.incremental = incremental
+        self.settle_seconds = settle_seconds
+        self.id_range = id_range
+        self.compression = compression
+        self.filters = filters or {}
+        self.progress = None  # called with the running row count every fetch_size rows
+        self.basename = 'data'
+        self.since = None
+        self.last_record = None
         self.data = []
 
     def ensure_output_dir(self):
@@ -22,195 +442,388 @@ class DataExporter:
             return obj.isoformat()
         return obj
 
-    def get_table_data(self):
-        conn = get_db()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
+    def normalize_record(self, record):
+        # Relationship view shared by every writer, built once per row
+        if self.table_name != 'returns':
+            return None
+
+        admin = None
+        if record.admin_id:
+            admin = {
+                'id': record.admin_id,
+                'name': record.admin_name
+            }
+
+        return {
+            'seller': {
+                'id': record.seller_id,
+                'name': record.seller_name
+            },
+            'customer': {
+                'id': record.customer_id,
+                'first_name': record.customer_first_name,
+                'last_name': record.customer_last_name,
+                'email': record.customer_email
+            },
+            'admin': admin,
+            'customer_name': f"{record.customer_first_name} {record.customer_last_name}",
+            'admin_name': record.admin_name or 'Not assigned'
+        }
+
+    def get_query(self, count=False):
+        if self.table_name == 'returns':
+            query = f'''
+                    SELECT
+                        {', '.join('r.' + column for column in RETURN_COLUMNS)},
+                        s.name as seller_name,
+                        c.first_name as customer_first_name,
+                        c.last_name as customer_last_name,
+                        c.email as customer_email,
+                        a.name as admin_name
+                    FROM returns r
+                             LEFT JOIN users s ON r.seller_id = s.id
+                             LEFT JOIN customers c ON r.customer_id = c.id
+                             LEFT JOIN users a ON r.admin_id = a.id
+                    '''
+        else:
+            query = f'SELECT * FROM {self.table_name} r'
+
+        conditions = []
+        params = []
+        order = 'r.id'
+
+        if self.id_range:
+            conditions.append('r.id BETWEEN %s AND %s')
+            params.extend(self.id_range)
+
+        # Same filters as the returns listing (parse_return_filters output), returns only
+        if self.filters:
+            where, filter_params = build_returns_where(self.filters)
+            if where:
+                conditions.append(where[len(' WHERE '):])
+                params.extend(filter_params)
+            if self.filters.get('q'):
+                conditions.append(f"r.search_vector @@ websearch_to_tsquery('{RETURN_SEARCH_CONFIG}', %s)")
+                params.append(self.filters['q'])
+
+        if self.incremental:
+            # Rows younger than settle_seconds may still belong to transactions that have
+            # not committed yet; they are picked up by the next run instead of being skipped
+            column = CHANGE_COLUMNS[self.table_name]
+            conditions.append(f"r.{column} <= CURRENT_TIMESTAMP - make_interval(secs => %s)")
+            params.append(self.settle_seconds)
+            if self.since:
+                conditions.append(f'(r.{column}, r.id) > (%s, %s)')
+                params.extend([self.since[column], self.since['id']])
+            order = f'r.{column}, r.id'
+
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if count:
+            return f'SELECT COUNT(*) FROM ({query}) counted', params
+        return query + f' ORDER BY {order}', params
+
+    def count_rows(self):
+        conn = get_db(readonly=True)
+        cur = conn.cursor()
         try:
-            if self.table_name == 'returns':
-                query = '''
-                        SELECT
-                            r.*,
-                            s.name as seller_name,
-                            c.first_name as customer_first_name,
-                            c.last_name as customer_last_name,
-                            c.email as customer_email,
-                            a.name as admin_name
-                        FROM returns r
-                                 LEFT JOIN users s ON r.seller_id = s.id
-                                 LEFT JOIN customers c ON r.customer_id = c.id
-                                 LEFT JOIN users a ON r.admin_id = a.id
-                        ORDER BY r.id \
-                        '''
-            else:
-                query = f'SELECT * FROM {self.table_name} ORDER BY id'
-
-            cur.execute(query)
-            self.data = cur.fetchall()
-
-            for record in self.data:
-                for key, value in record.items():
-                    record[key] = self.convert_to_serializable(value)
+            cur.execute(*self.get_query(count=True))
+            return cur.fetchone()[0]
+        finally:
+            cur.close()
+            conn.close()
 
-        except Exception as e:
-            print(f"Error: {e}")
+    def get_id_bounds(self):
+        conn = get_db(readonly=True)
+        cur = conn.cursor()
+        try:
+            cur.execute(f'SELECT MIN(id), MAX(id) FROM {self.table_name}')
+            return cur.fetchone()
         finally:
             cur.close()
             conn.close()
 
-    def export_to_json(self):
-        filename = os.path.join(self.output_dir, "data.json")
-
-        json_data = []
-        for record in self.data:
-            record_dict = dict(record)
-
-            if self.table_name == 'returns':
-                record_dict['seller'] = {
-                    'id': record['seller_id'],
-                    'name': record['seller_name']
-                }
-                record_dict['customer'] = {
-                    'id': record['customer_id'],
-                    'first_name': record['customer_first_name'],
-                    'last_name': record['customer_last_name'],
-                    'email': record['customer_email']
-                }
-                if record['admin_id']:
-                    record_dict['admin'] = {
-                        'id': record['admin_id'],
-                        'name': record['admin_name']
-                    }
-
-                keys_to_remove = ['seller_name', 'customer_first_name',
-                                  'customer_last_name', 'customer_email', 'admin_name']
-                for key in keys_to_remove:
-                    record_dict.pop(key, None)
-
-            json_data.append(record_dict)
-
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
-
-        print(f"JSON exported: {filename}")
+    def partition_id_ranges(self, partitions):
+        low, high = self.get_id_bounds()
+        if low is None:
+            return []
 
-    def export_to_csv(self):
-        filename = os.path.join(self.output_dir, "data.csv")
+        step = -(-(high - low + 1) // partitions)
+        return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
 
-        if not self.data:
-            return
+    def export_parallel(self, workers, formats=None):
+        # Each partition is exported by its own process and connection, then the files are stitched in id order
+        self.ensure_output_dir()
+        formats = formats or FORMATS
+        id_ranges = self.partition_id_ranges(workers)
+        parts_dir = tempfile.mkdtemp(prefix='.parts_', dir=self.output_dir)
 
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
-            fieldnames = list(self.data[0].keys())
+        try:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = [
+                    pool.submit(export_partition, self.table_name, parts_dir, formats,
+                                id_range, index, self.stream, self.fetch_size)
+                    for index, id_range in enumerate(id_ranges)
+                ]
+                counts = [future.result() for future in futures]
+
+            if not sum(counts):
+                print("No data to export")
+                return
+
+            for format_name in formats:
+                writer = WRITERS[format_name](self.output_dir, self.table_name, self.basename,
+                                              self.compression, self.fetch_size)
+                part_filenames = []
+                for index in range(len(id_ranges)):
+                    part_filename = os.path.join(parts_dir, f"part_{index}.{writer.extension}")
+                    if os.path.exists(part_filename):
+                        part_filenames.append(part_filename)
+                writer.merge(part_filenames)
+                print(f"{writer.extension.upper()} exported: {writer.filename}")
+        finally:
+            shutil.rmtree(parts_dir, ignore_errors=True)
 
-            if self.table_name == 'returns':
-                fieldnames = [f for f in fieldnames if not f.endswith('_id')]
-                fieldnames.extend(['seller_name', 'customer_name', 'admin_name'])
+        print(f"All formats exported from {len(id_ranges)} partitions")
 
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
+    def state_path(self):
+        return os.path.join(self.output_dir, STATE_FILE)
 
-            for record in self.data:
-                row_data = dict(record)
+    def load_state(self):
+        try:
+            with open(self.state_path(), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_high_water_mark(self):
+        column = CHANGE_COLUMNS[self.table_name]
+        state = self.load_state()
+        state[self.table_name] = {
+            column: self.convert_to_serializable(self.last_record[column]),
+            'id': self.last_record['id']
+        }
+
+        tmp_path = self.state_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path())
 
-                if self.table_name == 'returns':
-                    row_data['seller_name'] = record['seller_name']
-                    row_data['customer_name'] = f"{record['customer_first_name']} {record['customer_last_name']}"
-                    row_data['admin_name'] = record['admin_name'] or 'Not assigned'
+    def get_table_data(self):
+        conn = get_db(readonly=True)
+        cur = conn.cursor(cursor_factory=RecordCursor)
 
-                    for key in ['seller_id', 'customer_id', 'admin_id',
-                                'seller_name', 'customer_first_name',
-                                'customer_last_name', 'admin_name']:
-                        row_data.pop(key, None)
+        try:
+            cur.execute(*self.get_query())
+            self.data = cur.fetchall()
 
-                writer.writerow(row_data)
+        except Exception as e:
+            # A partition worker that swallowed this would leave a gap in the merged file
+            print(f"Error: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
 
-        print(f"CSV exported: {filename}")
+    def stream_table_data(self):
+        # Named cursor: Postgres keeps the result set, we hold fetch_size rows at a time
+        conn = get_db(readonly=True)
+        cur = conn.cursor(name=f'export_{self.table_name}', cursor_factory=RecordCursor)
+        cur.itersize = self.fetch_size
 
-    def export_to_xml(self):
-        filename = os.path.join(self.output_dir, "data.xml")
+        try:
+            cur.execute(*self.get_query())
+            yield from cur
+        finally:
+            cur.close()
+            conn.close()
 
-        root = ET.Element('data')
-        root.set('table', self.table_name)
-        root.set('exported', datetime.now().isoformat())
+    def iter_records(self):
+        records = self.stream_table_data() if self.stream else iter(self.data)
+        if not self.incremental:
+            return records
+        return self.track_last_record(records)
+
+    def track_last_record(self, records):
+        # Rows arrive ordered by (change column, id), so the last one is the new high-water mark
+        for record in records:
+            self.last_record = record
+            yield record
+
+    def prepare_rows(self, writers):
+        # Records stay native for columnar writers; text writers share one isoformat copy
+        needs_serializable = any(not writer.native_types for writer in writers)
+        for count, record in enumerate(self.iter_records(), 1):
+            serializable = serializable_record(record) if needs_serializable else None
+            yield record, serializable, self.normalize_record(record)
+            if self.progress is not None and count % self.fetch_size == 0:
+                self.progress(count)
+
+    def get_columns(self):
+        conn = get_db(readonly=True)
+        cur = conn.cursor()
+        try:
+            query, params = self.get_query()
+            cur.execute(query + ' LIMIT 0', params)
+            return [column.name for column in cur.description]
+        finally:
+            cur.close()
+            conn.close()
+
+    def export_formats(self, formats, threaded=False, queue_size=1000, write_empty=False):
+        writers = [WRITERS[format_name](self.output_dir, self.table_name, self.basename,
+                                        self.compression, self.fetch_size)
+                   for format_name in formats]
 
-        for record in self.data:
-            record_element = ET.SubElement(root, 'record')
+        try:
+            if threaded:
+                self.fan_out_threaded(writers, queue_size)
+            else:
+                for item in self.prepare_rows(writers):
+                    for writer in writers:
+                        writer.write_row(*item)
+        except Exception:
+            for writer in writers:
+                writer.abort()
+            raise
+
+        if write_empty and not any(writer.count for writer in writers):
+            columns = self.get_columns()
+            for writer in writers:
+                writer.write_empty(columns)
+
+        for writer in writers:
+            if writer.close():
+                print(f"{writer.extension.upper()} exported: {writer.filename}")
+        return max((writer.count for writer in writers), default=0)
+
+    def fan_out_threaded(self, writers, queue_size):
+        threads = [WriterThread(writer, queue_size) for writer in writers]
+        for thread in threads:
+            thread.start()
 
-            for key, value in record.items():
-                if value is None:
-                    continue
+        try:
+            for item in self.prepare_rows(writers):
+                for thread in threads:
+                    thread.queue.put(item)
+        finally:
+            for thread in threads:
+                thread.queue.put(None)
+            for thread in threads:
+                thread.join()
 
-                element = ET.SubElement(record_element, key)
+        for thread in threads:
+            if thread.error is not None:
+                raise thread.error
 
-                if self.table_name == 'returns' and key in ['seller_id', 'customer_id', 'admin_id']:
-                    element.set('id', str(value))
-                    if key == 'seller_id' and 'seller_name' in record:
-                        element.set('name', record['seller_name'])
-                    elif key == 'customer_id' and 'customer_first_name' in record:
-                        element.set('name', f"{record['customer_first_name']} {record['customer_last_name']}")
-                    elif key == 'admin_id' and record['admin_name']:
-                        element.set('name', record['admin_name'])
-                else:
-                    element.text = str(value)
+    def export_to_json(self):
+        return self.export_formats(['json'])
 
-        tree = ET.ElementTree(root)
-        tree.write(filename, encoding='utf-8', xml_declaration=True)
+    def export_to_csv(self):
+        return self.export_formats(['csv'])
 
-        print(f"XML exported: {filename}")
+    def export_to_xml(self):
+        return self.export_formats(['xml'])
 
     def export_to_yaml(self):
-        filename = os.path.join(self.output_dir, "data.yaml")
-
-        yaml_data = []
-        for record in self.data:
-            record_dict = dict(record)
-
-            if self.table_name == 'returns':
-                record_dict['relationships'] = {
-                    'seller': {
-                        'id': record['seller_id'],
-                        'name': record['seller_name']
-                    },
-                    'customer': {
-                        'id': record['customer_id'],
-                        'first_name': record['customer_first_name'],
-                        'last_name': record['customer_last_name'],
-                        'email': record['customer_email']
-                    }
-                }
-                if record['admin_id']:
-                    record_dict['relationships']['admin'] = {
-                        'id': record['admin_id'],
-                        'name': record['admin_name']
-                    }
-
-            yaml_data.append(record_dict)
-
-        with open(filename, 'w', encoding='utf-8') as f:
-            yaml.dump(yaml_data, f, default_flow_style=False, allow_unicode=True)
-
-        print(f"YAML exported: {filename}")
-
-    def export_all_formats(self):
+        return self.export_formats(['yaml'])
+
+    def export_all_formats(self, formats=None, threaded=False, queue_size=1000):
         self.ensure_output_dir()
-        self.get_table_data()
 
-        if not self.data:
+        if self.incremental:
+            self.since = self.load_state().get(self.table_name)
+            if self.since:
+                self.basename = f"delta_{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+
+        if not self.stream:
+            self.get_table_data()
+
+            if not self.data:
+                print("No data to export")
+                return
+
+        count = self.export_formats(formats or FORMATS, threaded, queue_size)
+
+        if not count:
             print("No data to export")
             return
 
-        self.export_to_json()
-        self.export_to_csv()
-        self.export_to_xml()
-        self.export_to_yaml()
+        if self.incremental:
+            self.save_high_water_mark()
+            print(f"Exported {count} changed rows")
 
         print("All formats exported")
 
+def export_partition(table_name, output_dir, formats, id_range, index, stream, fetch_size):
+    exporter = DataExporter(table_name, output_dir, stream=stream, fetch_size=fetch_size, id_range=id_range)
+    exporter.basename = f"part_{index}"
+    if not stream:
+        exporter.get_table_data()
+    return exporter.export_formats(formats)
+
+def lock_output_dir(output_dir):
+    # Held for the whole run so two exports into the same directory cannot interleave their files
+    os.makedirs(output_dir, exist_ok=True)
+    lock = open(os.path.join(output_dir, LOCK_FILE), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
 def main():
-    table_name = "returns"
-    exporter = DataExporter(table_name)
-    exporter.export_all_formats()
+    parser = argparse.ArgumentParser(description='Export a table to JSON, CSV, XML and YAML')
+    parser.add_argument('table_name', nargs='?', default='returns')
+    parser.add_argument('--output-dir', default='out')
+    parser.add_argument('--stream', action='store_true',
+                        help='read through a server-side cursor and write records incrementally')
+    parser.add_argument('--fetch-size', type=int, default=1000)
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help=f"comma-separated list from {', '.join(WRITERS)}")
+    parser.add_argument('--threads', action='store_true',
+                        help='run each format writer on its own thread')
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--incremental', action='store_true',
+                        help='export only rows changed since the last incremental run into delta_* files')
+    parser.add_argument('--settle-seconds', type=int, default=60,
+                        help='leave rows changed within this many seconds for the next incremental run')
+    parser.add_argument('--compression', choices=list(COMPRESSION_SUFFIXES),
+                        help='compress text outputs; also used as the Parquet/Arrow codec')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='split the id range into this many partitions exported by separate processes')
+    parser.add_argument('--profile', action='store_true',
+                        help='print where the time went: connection checkout, query execution and row fetch; '
+                             'the remainder is serialization and writing')
+    args = parser.parse_args()
+
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in WRITERS]
+    if unknown:
+        parser.error(f"unknown format: {', '.join(unknown)}")
+
+    lock = lock_output_dir(args.output_dir)
+    if lock is None:
+        print(f"Error: another export is writing to {args.output_dir}")
+        sys.exit(1)
+
+    exporter = DataExporter(args.table_name, args.output_dir, stream=args.stream, fetch_size=args.fetch_size,
+                            incremental=args.incremental, settle_seconds=args.settle_seconds,
+                            compression=args.compression)
+    if args.profile:
+        start_profile(f"export {args.table_name}")
+    if args.workers > 1:
+        if args.incremental:
+            parser.error('--workers cannot be combined with --incremental')
+        exporter.export_parallel(args.workers, formats)
+    else:
+        exporter.export_all_formats(formats, threaded=args.threads, queue_size=args.queue_size)
+
+    profile = finish_profile()
+    if profile is not None:
+        print(profile.summary())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from export_data import CHANGE_COLUMNS, COMPRESSION_SUFFIXES, WRITERS, DataExporter
+
+# Exports queued from the web app. Each job runs on a bounded pool of threads and writes into its
+# own directory under EXPORT_JOBS_DIR, next to a job.json holding its state, so any worker process
+# can report on it and no two exports share a file.
+
+EXPORT_JOBS_DIR = os.environ.get('EXPORT_JOBS_DIR', os.path.join('out', 'jobs'))
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '2'))
+EXPORT_MAX_QUEUED = int(os.environ.get('EXPORT_MAX_QUEUED', '10'))
+EXPORT_JOB_TTL = float(os.environ.get('EXPORT_JOB_TTL', '86400'))
+EXPORT_FETCH_SIZE = 1000
+EXPORT_PROGRESS_INTERVAL = 1.0
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_POLL_SECONDS = 0.5
+DOWNLOAD_STALL_SECONDS = float(os.environ.get('DOWNLOAD_STALL_SECONDS', '300'))
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+FINISHED = ('done', 'failed')
+
+MIMETYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'xml': 'application/xml',
+    'yaml': 'application/yaml',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file'
+}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def job_dir(job_id):
+    return os.path.join(EXPORT_JOBS_DIR, job_id)
+
+
+def output_path(job):
+    writer = WRITERS[job['format']](job_dir(job['id']), job['table'], job['table'], job['compression'])
+    return writer.filename
+
+
+def download_name(job):
+    # returns.csv.gz -> returns_<job id>.csv.gz
+    filename = os.path.basename(output_path(job))
+    return f"{job['table']}_{job['id']}{filename[len(job['table']):]}"
+
+
+def mimetype(job):
+    if job['compression'] and not WRITERS[job['format']].native_types:
+        return 'application/gzip' if job['compression'] == 'gzip' else 'application/zstd'
+    return MIMETYPES[job['format']]
+
+
+def streamable(job):
+    # Text files are readable while they grow; Parquet and Arrow are only valid once their footer is written
+    return not WRITERS[job['format']].native_types
+
+
+def save_job(job):
+    path = os.path.join(job_dir(job['id']), 'job.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_job(job_id):
+    # The state last saved to job.json, as seen by any process sharing EXPORT_JOBS_DIR
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    try:
+        with open(os.path.join(job_dir(job_id), 'job.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ExportJobs:
+    def __init__(self, workers=EXPORT_WORKERS, max_queued=EXPORT_MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export-job')
+        self.lock = threading.Lock()
+        self.jobs = {}  # id -> state of the jobs queued or running in this process
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def validate(self, table, format_name, compression, filters):
+        if table not in CHANGE_COLUMNS:
+            return f"unknown table, expected one of: {', '.join(CHANGE_COLUMNS)}"
+        if format_name not in WRITERS:
+            return f"unknown format, expected one of: {', '.join(WRITERS)}"
+        if compression and compression not in COMPRESSION_SUFFIXES:
+            return f"unknown compression, expected one of: {', '.join(COMPRESSION_SUFFIXES)}"
+        if filters and table != 'returns':
+            return 'filters are only supported for returns'
+        return None
+
+    def submit(self, table, format_name, compression=None, filters=None):
+        with self.lock:
+            if len(self.jobs) >= self.workers + self.max_queued:
+                self.rejected += 1
+                raise JobQueueFull(f"{len(self.jobs)} exports already queued or running")
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'table': table,
+                'format': format_name,
+                'compression': compression,
+                'filters': filters or {},
+                'status': 'queued',
+                'rows': 0,
+                'total': None,
+                'error': None,
+                'pid': os.getpid(),
+                'host': socket.gethostname(),
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None
+            }
+            self.jobs[job['id']] = job
+
+        self.cleanup()
+        os.makedirs(job_dir(job['id']))
+        save_job(job)
+        self.executor.submit(self.run, job)
+        return dict(job)
+
+    def run(self, job):
+        exporter = DataExporter(job['table'], job_dir(job['id']), stream=True, fetch_size=EXPORT_FETCH_SIZE,
+                                compression=job['compression'], filters=job['filters'])
+        exporter.basename = job['table']
+        last_saved = [time.monotonic()]
+
+        def progress(count):
+            job['rows'] = count
+            if time.monotonic() - last_saved[0] >= EXPORT_PROGRESS_INTERVAL:
+                save_job(job)
+                last_saved[0] = time.monotonic()
+
+        exporter.progress = progress
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        save_job(job)
+
+        try:
+            job['total'] = exporter.count_rows()
+            save_job(job)
+            # An export that matched nothing still gets its file: [] for JSON, the header row for CSV
+            job['rows'] = exporter.export_formats([job['format']], write_empty=True)
+            job['status'] = 'done'
+            with self.lock:
+                self.completed += 1
+        except Exception as e:
+            print(f"Export job {job['id']} failed: {e}")
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            with self.lock:
+                self.failed += 1
+            if os.path.exists(output_path(job)):
+                os.remove(output_path(job))
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+            save_job(job)
+            with self.lock:
+                self.jobs.pop(job['id'], None)
+
+    def get(self, job_id):
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        job = load_job(job_id)
+        if job is None:
+            return None
+
+        # Unfinished, but not ours: only trust it while the process that queued it is still there.
+        # Pids only mean something on the host (or container) that queued the job.
+        if job['status'] not in FINISHED and job.get('host') == socket.gethostname() and \
+                (job['pid'] == os.getpid() or not process_alive(job['pid'])):
+            job['status'] = 'failed'
+            job['error'] = 'the process running this export exited'
+        return job
+
+    def list(self):
+        jobs = []
+        if os.path.isdir(EXPORT_JOBS_DIR):
+            for job_id in os.listdir(EXPORT_JOBS_DIR):
+                job = self.get(job_id)
+                if job is not None:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+    def cleanup(self):
+        # Finished jobs and their files are kept for EXPORT_JOB_TTL seconds
+        cutoff = datetime.fromtimestamp(time.time() - EXPORT_JOB_TTL).isoformat()
+        for job in self.list():
+            if job['status'] in FINISHED and (job['finished_at'] or job['created_at']) < cutoff:
+                shutil.rmtree(job_dir(job['id']), ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if job['status'] == 'running')
+            return {
+                'workers': self.workers,
+                'running': running,
+                'queued': len(self.jobs) - running,
+                'completed_total': self.completed,
+                'failed_total': self.failed,
+                'rejected_total': self.rejected
+            }
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_jobs():
+    # The pool's threads are only started once the first export is queued
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs = ExportJobs()
+    return _jobs
+
+
+def export_job_metrics():
+    if _jobs is None:
+        return ''
+    lines = []
+    for key, value in _jobs.stats().items():
+        lines.append(f"export_jobs_{key} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+from flask import before_render_template, request, template_rendered
+
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', '0.25'))
+SLOW_QUERY_MAX_CHARS = 2000
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('connect', 'execute', 'fetch', 'render')
+
+
+def format_labels(pairs):
+    labels = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append(f'{name}="{value}"')
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> per-bucket counts (not cumulative), then sum and count
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = sorted((key, list(values)) for key, values in self._series.items())
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_values, values in snapshot:
+            pairs = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(pairs + [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {values[-2]}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self):
+        with self._lock:
+            self.value += 1
+
+    def render(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+request_seconds = Histogram('http_request_duration_seconds', 'Wall time per request',
+                            ('endpoint', 'method', 'status'))
+request_phase_seconds = Histogram('http_request_phase_seconds', 'Time per request spent in each phase',
+                                  ('endpoint', 'phase'))
+db_statement_seconds = Histogram('db_statement_duration_seconds', 'Time per cursor call', ('phase',))
+slow_queries = Counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_SECONDS')
+
+
+class Profile:
+    # Time accumulated per phase by everything running on one thread between start and finish
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.render_started = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        timings = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items() if seconds]
+        return ', '.join(timings + [f"total;dur={self.elapsed() * 1000:.1f}"])
+
+    def summary(self):
+        phases = ', '.join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases.items() if seconds)
+        return f"{self.name}: {self.elapsed():.3f}s total, {self.queries} queries ({phases or 'no database time'})"
+
+
+_local = threading.local()
+
+
+def start_profile(name):
+    _local.profile = Profile(name)
+    return _local.profile
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+def finish_profile():
+    profile = current_profile()
+    _local.profile = None
+    return profile
+
+
+def record_phase(phase, seconds):
+    profile = current_profile()
+    if profile is not None:
+        profile.phases[phase] += seconds
+
+
+def log_slow_query(seconds, query, params):
+    slow_queries.inc()
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    sql = ' '.join(str(query).split())[:SLOW_QUERY_MAX_CHARS]
+    print(f"Slow query ({seconds * 1000:.1f} ms): {sql} params={repr(params)[:SLOW_QUERY_MAX_CHARS]}")
+
+
+class TimedCursor:
+    # Wraps a psycopg2 cursor so execute and fetch time is attributed to the current profile
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._cursor.__exit__(exc_type, exc, tb)
+
+    def __iter__(self):
+        # Batches of itersize so a streaming export is not timed row by row
+        while True:
+            rows = self.fetchmany(self._cursor.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def _timed(self, phase, method, *args, query=None, params=None):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            record_phase(phase, elapsed)
+            db_statement_seconds.observe(elapsed, phase)
+            if query is not None:
+                profile = current_profile()
+                if profile is not None:
+                    profile.queries += 1
+                if elapsed >= SLOW_QUERY_SECONDS:
+                    log_slow_query(elapsed, query, params)
+
+    def execute(self, query, params=None):
+        return self._timed('execute', self._cursor.execute, query, params, query=query, params=params)
+
+    def executemany(self, query, params_list):
+        return self._timed('execute', self._cursor.executemany, query, params_list,
+                           query=query, params=params_list)
+
+    def copy_expert(self, sql, file, *args):
+        return self._timed('execute', self._cursor.copy_expert, sql, file, *args, query=sql)
+
+    def fetchone(self):
+        return self._timed('fetch', self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed('fetch', self._cursor.fetchmany, self._cursor.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed('fetch', self._cursor.fetchall)
+
+
+def request_metrics():
+    lines = []
+    for metric in (request_seconds, request_phase_seconds, db_statement_seconds, slow_queries):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    @app.before_request
+    def start_request_profile():
+        start_profile(request.endpoint or 'unmatched')
+
+    @app.after_request
+    def finish_request_profile(response):
+        profile = finish_profile()
+        if profile is not None:
+            endpoint = request.endpoint or 'unmatched'
+            request_seconds.observe(profile.elapsed(), endpoint, request.method, str(response.status_code))
+            for phase, seconds in profile.phases.items():
+                request_phase_seconds.observe(seconds, endpoint, phase)
+            response.headers['Server-Timing'] = profile.server_timing()
+        return response
+
+    @app.teardown_request
+    def discard_request_profile(exception=None):
+        finish_profile()
+
+    def render_started(sender, template, context, **extra):
+        profile = current_profile()
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        profile = current_profile()
+        if profile is not None and profile.render_started is not None:
+            profile.phases['render'] += time.perf_counter() - profile.render_started
+            profile.render_started = None
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
@@ -0,0 +1,173 @@
+import os
+import json
+import asyncio
+import jinja2
+from aiohttp import web
+from migrations import RETURNS_CHANNEL
+from queries import RETURNS_SELECT, numbered
+
+# Served by the async API (async_api.py), not Flask: an event stream never ends, and on the Flask
+# side each open admin tab would hold a request worker for as long as it stays open
+
+LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE', '100'))
+# The stream carries customer and product data, so only the admin page's origin may read it. Unset,
+# that is the Flask app on this host at WEB_APP_PORT
+LIVE_ALLOWED_ORIGIN = os.environ.get('LIVE_ALLOWED_ORIGIN') or None
+WEB_APP_PORT = os.environ.get('WEB_APP_PORT', '5000')
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_COALESCE_SECONDS = 0.05
+LIVE_MAX_ROWS_PER_BATCH = 500
+LISTEN_RETRY_SECONDS = 5
+
+# The same admin_row.html the Flask admin page includes, autoescaped as Flask does
+templates = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+    autoescape=jinja2.select_autoescape(['html'])
+)
+
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChangeListener:
+    # One per process: LISTENs on its own connection, loads each changed row once and
+    # fans the rendered row out to every connected admin page
+
+    def __init__(self, pool, connect):
+        self.pool = pool
+        self.connect = connect
+        self.subscribers = set()
+        self.pending = {'upsert': set(), 'delete': set()}
+        self.flush_task = None
+        self.events = 0
+        self.overflows = 0
+
+    def subscribe(self):
+        subscriber = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        message = sse_message(event, data)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.put_nowait(message)
+            except asyncio.QueueFull:
+                # The client stopped keeping up; whatever it missed is replaced by one reload hint
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(sse_message('reload', {}))
+                self.overflows += 1
+        self.events += 1
+
+    async def run(self):
+        while True:
+            conn = None
+            try:
+                conn = await self.connect()
+                await conn.add_listener(RETURNS_CHANNEL, self.notified)
+                while True:
+                    # A round trip now and then notices a dead connection
+                    await asyncio.sleep(LIVE_HEARTBEAT_SECONDS)
+                    await conn.execute('SELECT 1')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Returns change listener error: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            # Changes made while disconnected were never delivered
+            self.publish('reload', {})
+            await asyncio.sleep(LISTEN_RETRY_SECONDS)
+
+    def notified(self, connection, pid, channel, payload):
+        operation, _, ids = payload.partition(':')
+        self.pending.setdefault(operation, set()).update(int(value) for value in ids.split(',') if value)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        # Let a burst of commits arrive so it is loaded with one query
+        await asyncio.sleep(LIVE_COALESCE_SECONDS)
+        changes, self.pending = self.pending, {'upsert': set(), 'delete': set()}
+        self.flush_task = None
+        try:
+            await self.dispatch(changes['upsert'] - changes['delete'], changes['delete'])
+        except Exception as e:
+            print(f"Returns change listener error: {e}")
+            self.publish('reload', {})
+
+    async def dispatch(self, upserts, deletes):
+        if not self.subscribers:
+            return
+        if len(upserts) + len(deletes) > LIVE_MAX_ROWS_PER_BATCH:
+            self.publish('reload', {})
+            return
+
+        for return_id in sorted(deletes):
+            self.publish('delete', {'id': return_id})
+        if not upserts:
+            return
+
+        rows = await self.pool.fetch(numbered(RETURNS_SELECT + ' WHERE r.id = ANY(%s) ORDER BY r.id'), sorted(upserts))
+        template = templates.get_template('admin_row.html')
+        for row in rows:
+            html = template.render(**{'return': row})
+            self.publish('upsert', {'id': row['id'], 'status': row['status'], 'html': html})
+
+    def stats(self):
+        return {
+            'subscribers': len(self.subscribers),
+            'events_total': self.events,
+            'overflows_total': self.overflows
+        }
+
+
+def allowed_origin(request):
+    if LIVE_ALLOWED_ORIGIN:
+        return LIVE_ALLOWED_ORIGIN
+    origin = request.headers.get('Origin')
+    if origin == f"{request.scheme}://{request.url.host}:{WEB_APP_PORT}":
+        return origin
+    return None
+
+
+async def event_stream(request, listener):
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # The admin page is served by the Flask app, usually on another port; other origins get no CORS header
+    origin = allowed_origin(request)
+    if origin:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Vary'] = 'Origin'
+    await response.prepare(request)
+
+    subscriber = listener.subscribe()
+    try:
+        await response.write(f"retry: {LISTEN_RETRY_SECONDS * 1000}\n\n".encode())
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.get(), LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                message = ": keepalive\n\n"
+            await response.write(message.encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        listener.unsubscribe(subscriber)
+    return response
+
+
+def live_metrics(listener):
+    lines = []
+    for key, value in listener.stats().items():
+        lines.append(f"live_{key} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,239 @@
+from database import get_db
+from summary import create_change_counter, create_summary_tables, rebuild_summary_tables
+from partitions import create_archive_table, ensure_partitions, partition_returns, partitions_missing
+
+# Arbitrary constant shared by every process that may run migrations
+MIGRATION_LOCK_ID = 72_315_001
+
+
+def create_base_tables(cur):
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                                                     id SERIAL PRIMARY KEY,
+                                                     name VARCHAR(100) NOT NULL,
+                                                     user_type VARCHAR(20) NOT NULL CHECK (user_type IN ('seller', 'admin')),
+                                                     email VARCHAR(100) UNIQUE,
+                                                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                ''')
+
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS customers (
+                                                         id SERIAL PRIMARY KEY,
+                                                         first_name VARCHAR(100) NOT NULL,
+                                                         last_name VARCHAR(100) NOT NULL,
+                                                         email VARCHAR(100),
+                                                         phone VARCHAR(20),
+                                                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                ''')
+
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS returns (
+                                                       id SERIAL PRIMARY KEY,
+                                                       seller_id INTEGER NOT NULL,
+                                                       customer_id INTEGER NOT NULL,
+                                                       admin_id INTEGER,
+                                                       purchase_date DATE NOT NULL,
+                                                       product_name VARCHAR(100) NOT NULL,
+                                                       reason TEXT NOT NULL,
+                                                       status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'approved', 'rejected')),
+                                                       comment TEXT,
+                                                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                                       updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                                       CONSTRAINT fk_returns_seller
+                                                           FOREIGN KEY (seller_id) REFERENCES users(id) ON DELETE RESTRICT,
+
+                                                       CONSTRAINT fk_returns_customer
+                                                           FOREIGN KEY (customer_id) REFERENCES customers(id) ON DELETE RESTRICT,
+
+                                                       CONSTRAINT fk_returns_admin
+                                                           FOREIGN KEY (admin_id) REFERENCES users(id) ON DELETE SET NULL
+                )
+                ''')
+
+
+def create_listing_indexes(cur):
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_created_id ON returns (created_at DESC, id DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_status_created_id ON returns (status, created_at DESC, id DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_seller_created_id ON returns (seller_id, created_at DESC, id DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_customer_created_id ON returns (customer_id, created_at DESC, id DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_purchase_date ON returns (purchase_date)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_updated_id ON returns (updated_at, id)')
+
+
+def create_summary(cur):
+    create_summary_tables(cur)
+    rebuild_summary_tables(cur)
+
+
+# Customer typeahead matches against this expression; queries must repeat it verbatim to use the index
+CUSTOMER_SEARCH_EXPR = "lower(first_name || ' ' || last_name || ' ' || COALESCE(email, ''))"
+
+
+def create_customer_search_index(cur):
+    cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    cur.execute(f'CREATE INDEX IF NOT EXISTS idx_customers_search ON customers USING gin ({CUSTOMER_SEARCH_EXPR} gin_trgm_ops)')
+
+
+# Text search configuration baked into search_vector; queries must parse with the same one
+RETURN_SEARCH_CONFIG = 'english'
+
+
+def create_return_search(cur):
+    # Generated column: every insert and update path (forms, bulk, COPY) keeps it current
+    cur.execute(f'''
+                ALTER TABLE returns ADD COLUMN IF NOT EXISTS search_vector tsvector
+                    GENERATED ALWAYS AS (
+                        setweight(to_tsvector('{RETURN_SEARCH_CONFIG}', coalesce(product_name, '')), 'A') ||
+                        setweight(to_tsvector('{RETURN_SEARCH_CONFIG}', coalesce(reason, '')), 'B') ||
+                        setweight(to_tsvector('{RETURN_SEARCH_CONFIG}', coalesce(comment, '')), 'C')
+                    ) STORED
+                ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_search ON returns USING gin (search_vector)')
+
+
+# Channel for returns change notifications, payload 'upsert:1,2,3' or 'delete:4'
+RETURNS_CHANNEL = 'returns_changes'
+NOTIFY_IDS_PER_MESSAGE = 500
+
+
+def create_change_notifications(cur):
+    # Statement-level with transition tables: a bulk update sends a handful of notifications, not one per row
+    cur.execute(f'''
+                CREATE OR REPLACE FUNCTION returns_notify_changes() RETURNS trigger AS $$
+                DECLARE
+                    ids TEXT;
+                BEGIN
+                    FOR ids IN
+                        SELECT string_agg(id::text, ',')
+                        FROM (SELECT id, (row_number() OVER (ORDER BY id) - 1) / {NOTIFY_IDS_PER_MESSAGE} AS chunk
+                              FROM changed) numbered
+                        GROUP BY chunk
+                    LOOP
+                        PERFORM pg_notify('{RETURNS_CHANNEL}', TG_ARGV[0] || ':' || ids);
+                    END LOOP;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+                ''')
+    cur.execute('DROP TRIGGER IF EXISTS returns_notify_insert ON returns')
+    cur.execute('DROP TRIGGER IF EXISTS returns_notify_update ON returns')
+    cur.execute('DROP TRIGGER IF EXISTS returns_notify_delete ON returns')
+    cur.execute('''
+                CREATE TRIGGER returns_notify_insert
+                    AFTER INSERT ON returns REFERENCING NEW TABLE AS changed
+                    FOR EACH STATEMENT EXECUTE FUNCTION returns_notify_changes('upsert')
+                ''')
+    cur.execute('''
+                CREATE TRIGGER returns_notify_update
+                    AFTER UPDATE ON returns REFERENCING NEW TABLE AS changed
+                    FOR EACH STATEMENT EXECUTE FUNCTION returns_notify_changes('upsert')
+                ''')
+    cur.execute('''
+                CREATE TRIGGER returns_notify_delete
+                    AFTER DELETE ON returns REFERENCING OLD TABLE AS changed
+                    FOR EACH STATEMENT EXECUTE FUNCTION returns_notify_changes('delete')
+                ''')
+
+
+def partition_by_month(cur):
+    # Rebuilds returns as a partitioned table; the listing indexes and summary triggers
+    # are declared on the parent and cascade to every partition
+    partition_returns(cur)
+    create_listing_indexes(cur)
+    create_summary_tables(cur)
+
+
+# Append only: each step must be safe to run against a database that already has
+# the objects it creates, since databases built by the old init_db have no history
+MIGRATIONS = [
+    (1, 'base tables', create_base_tables),
+    (2, 'listing indexes', create_listing_indexes),
+    (3, 'summary counters', create_summary),
+    (4, 'customer search index', create_customer_search_index),
+    (5, 'monthly returns partitions', partition_by_month),
+    (6, 'returns archive', create_archive_table),
+    (7, 'return full-text search', create_return_search),
+    (8, 'returns change notifications', create_change_notifications),
+    (9, 'seller summary counters', create_summary),
+    (10, 'returns change counter', create_change_counter),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cur):
+    cur.execute("SELECT to_regclass('schema_migrations')")
+    if cur.fetchone()[0] is None:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+
+def migrate(conn):
+    cur = conn.cursor()
+    # Only one process applies migrations; the others wait here and then find nothing to do
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        cur.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                                                                     version INTEGER PRIMARY KEY,
+                                                                     name VARCHAR(100) NOT NULL,
+                                                                     applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                    ''')
+        conn.commit()
+
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+
+        for version, name, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            apply(cur)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            print(f"Applied migration {version}: {name}")
+
+        for name in ensure_partitions(cur):
+            print(f"Created partition {name}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+        cur.close()
+
+
+def ensure_schema():
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        version = current_version(cur)
+        missing = version >= LATEST_VERSION and partitions_missing(cur)
+        cur.close()
+        conn.rollback()
+        if version < LATEST_VERSION or missing:
+            migrate(conn)
+    finally:
+        conn.close()
+
+
+def drop_schema(cur):
+    cur.execute('DROP TABLE IF EXISTS schema_migrations')
+    cur.execute('DROP TABLE IF EXISTS return_daily_counts')
+    cur.execute('DROP TABLE IF EXISTS return_status_counts')
+    cur.execute('DROP TABLE IF EXISTS return_seller_counts')
+    cur.execute('DROP TABLE IF EXISTS return_changes')
+    cur.execute('DROP TABLE IF EXISTS returns_archive')
+    cur.execute('DROP TABLE IF EXISTS returns CASCADE')
+    cur.execute('DROP TABLE IF EXISTS customers CASCADE')
+    cur.execute('DROP TABLE IF EXISTS users CASCADE')
+
+
+if __name__ == '__main__':
+    ensure_schema()
+    print(f"Database schema at version {LATEST_VERSION}")
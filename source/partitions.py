@@ -0,0 +1,299 @@
+import os
+import argparse
+import threading
+import time
+from datetime import date, datetime, timedelta
+import psycopg2.extras
+
+# returns is range-partitioned on created_at, one partition per month. There is deliberately no
+# DEFAULT partition: without one the planner can walk partitions newest first and stop at LIMIT,
+# so months have to exist before rows arrive. Migrations and seeding create them, and every long-running
+# process (the Flask app, the async API) keeps PARTITION_PREMAKE_MONTHS ahead with a background check.
+
+PARTITION_PREMAKE_MONTHS = int(os.environ.get('PARTITION_PREMAKE_MONTHS', '3'))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '365'))
+PARTITION_CHECK_SECONDS = float(os.environ.get('PARTITION_CHECK_SECONDS', '3600'))
+ARCHIVE_BATCH_SIZE = 10000
+ARCHIVE_STATUSES = ('approved', 'rejected')
+
+RETURN_COLUMNS = ('id', 'seller_id', 'customer_id', 'admin_id', 'purchase_date', 'product_name', 'reason',
+                  'status', 'comment', 'created_at', 'updated_at')
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"returns_p{month.year:04d}{month.month:02d}"
+
+
+def existing_partitions(cur):
+    cur.execute('''
+                SELECT c.relname
+                FROM pg_inherits i
+                         JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'returns'::regclass
+                ''')
+    return {row[0] for row in cur.fetchall()}
+
+
+def create_partition(cur, month):
+    name = partition_name(month)
+    cur.execute(f"CREATE TABLE {name} PARTITION OF returns "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')")
+    return name
+
+
+def ensure_partitions(cur, start=None, end=None):
+    # Every month from start (default: this month) through PARTITION_PREMAKE_MONTHS past end (default: today)
+    today = date.today()
+    month = month_start(start or today)
+    last = month_start(end or today)
+    for _ in range(PARTITION_PREMAKE_MONTHS):
+        last = next_month(last)
+
+    existing = existing_partitions(cur)
+    created = []
+    while month <= last:
+        if partition_name(month) not in existing:
+            created.append(create_partition(cur, month))
+        month = next_month(month)
+    return created
+
+
+def partitions_missing(cur):
+    month = month_start(date.today())
+    for _ in range(PARTITION_PREMAKE_MONTHS):
+        month = next_month(month)
+    return partition_name(month) not in existing_partitions(cur)
+
+
+class PartitionMaintainer(threading.Thread):
+    # Creates upcoming months from inside the process, so inserts never outrun the partitions
+    # however long the process runs; concurrent creators just retry on the next round
+
+    def __init__(self, interval=PARTITION_CHECK_SECONDS):
+        super().__init__(name='returns-partition-maintainer', daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        from database import connect
+
+        try:
+            conn = connect()
+        except Exception as e:
+            print(f"Partition check error: {e}")
+            return
+        try:
+            cur = conn.cursor()
+            created = ensure_partitions(cur)
+            conn.commit()
+            for name in created:
+                print(f"Created partition {name}")
+        except Exception as e:
+            conn.rollback()
+            print(f"Partition check error: {e}")
+        finally:
+            conn.close()
+
+
+_maintainer = None
+_maintainer_lock = threading.Lock()
+
+
+def start_partition_maintenance():
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None:
+            _maintainer = PartitionMaintainer()
+            _maintainer.start()
+    return _maintainer
+
+
+def partition_returns(cur):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('returns')")
+    if cur.fetchone()[0] == 'p':
+        return
+
+    # Index and primary key names are schema-wide, so free them for the partitioned table
+    cur.execute('ALTER TABLE returns RENAME TO returns_unpartitioned')
+    cur.execute('ALTER TABLE returns_unpartitioned RENAME CONSTRAINT returns_pkey TO returns_unpartitioned_pkey')
+    cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'returns_unpartitioned' AND indexname LIKE 'idx_returns_%'")
+    for (index,) in cur.fetchall():
+        cur.execute(f'DROP INDEX {index}')
+
+    # The partition key has to be part of the primary key; ids still come from the old sequence
+    cur.execute('''
+                CREATE TABLE returns (
+                                         id INTEGER NOT NULL DEFAULT nextval('returns_id_seq'),
+                                         seller_id INTEGER NOT NULL,
+                                         customer_id INTEGER NOT NULL,
+                                         admin_id INTEGER,
+                                         purchase_date DATE NOT NULL,
+                                         product_name VARCHAR(100) NOT NULL,
+                                         reason TEXT NOT NULL,
+                                         status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'approved', 'rejected')),
+                                         comment TEXT,
+                                         created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                         PRIMARY KEY (id, created_at),
+                                         CONSTRAINT fk_returns_seller
+                                             FOREIGN KEY (seller_id) REFERENCES users(id) ON DELETE RESTRICT,
+
+                                         CONSTRAINT fk_returns_customer
+                                             FOREIGN KEY (customer_id) REFERENCES customers(id) ON DELETE RESTRICT,
+
+                                         CONSTRAINT fk_returns_admin
+                                             FOREIGN KEY (admin_id) REFERENCES users(id) ON DELETE SET NULL
+                ) PARTITION BY RANGE (created_at)
+                ''')
+    cur.execute('SELECT MIN(created_at) FROM returns_unpartitioned')
+    oldest = cur.fetchone()[0]
+    ensure_partitions(cur, oldest)
+
+    columns = ', '.join(RETURN_COLUMNS)
+    cur.execute(f'''
+                INSERT INTO returns ({columns})
+                SELECT {columns.replace('created_at', 'COALESCE(created_at, updated_at, CURRENT_TIMESTAMP)')}
+                FROM returns_unpartitioned
+                ''')
+    print(f"Copied {cur.rowcount} returns into monthly partitions")
+
+    cur.execute('ALTER SEQUENCE returns_id_seq OWNED BY returns.id')
+    cur.execute('DROP TABLE returns_unpartitioned')
+
+
+def create_archive_table(cur):
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS returns_archive (
+                    LIKE returns INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id)
+                )
+                ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_returns_archive_created ON returns_archive (created_at)')
+
+
+def archive_batch_sql(target):
+    columns = ', '.join(RETURN_COLUMNS)
+    moved = f'''
+            WITH moved AS (
+                DELETE FROM returns
+                WHERE (id, created_at) IN (
+                    SELECT id, created_at FROM returns
+                    WHERE status IN %s AND created_at < %s
+                    ORDER BY created_at, id
+                    LIMIT %s
+                )
+                RETURNING {columns}
+            )
+            '''
+    if target == 'table':
+        return moved + f'INSERT INTO returns_archive ({columns}) SELECT {columns} FROM moved'
+    return moved + 'SELECT * FROM moved ORDER BY created_at, id'
+
+
+def drop_empty_partitions(cur, cutoff):
+    # Months that ended before the cutoff and have nothing left (no pending returns) are dropped
+    dropped = []
+    for name in sorted(existing_partitions(cur)):
+        month = datetime.strptime(name, 'returns_p%Y%m').date()
+        if next_month(month) > cutoff.date():
+            continue
+        cur.execute(f'SELECT EXISTS (SELECT 1 FROM {name})')
+        if not cur.fetchone()[0]:
+            cur.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    return dropped
+
+
+def archive_returns(conn, retention_days=ARCHIVE_RETENTION_DAYS, parquet_dir=None, batch_size=ARCHIVE_BATCH_SIZE):
+    # Closed returns older than the retention window leave the hot table in committed batches,
+    # either into returns_archive or into one Parquet file per batch
+    cutoff = datetime.combine(date.today() - timedelta(days=retention_days), datetime.min.time())
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    maintenance = conn.cursor()
+    sql = archive_batch_sql('parquet' if parquet_dir else 'table')
+    archived = 0
+    files = []
+
+    try:
+        while True:
+            cur.execute(sql, (ARCHIVE_STATUSES, cutoff, batch_size))
+            if parquet_dir:
+                rows = cur.fetchall()
+                count = len(rows)
+                if count:
+                    files.append(write_parquet_batch(parquet_dir, cutoff, len(files), rows, conn))
+            else:
+                count = cur.rowcount
+                conn.commit()
+            if not count:
+                break
+            archived += count
+            print(f"Archived {archived} returns created before {cutoff.date()}")
+
+        dropped = drop_empty_partitions(maintenance, cutoff)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        maintenance.close()
+
+    for name in dropped:
+        print(f"Dropped empty partition {name}")
+    return archived, files
+
+
+def write_parquet_batch(output_dir, cutoff, index, rows, conn):
+    from export_data import ParquetWriter
+
+    # The rows are only deleted once their file is complete
+    os.makedirs(output_dir, exist_ok=True)
+    writer = ParquetWriter(output_dir, 'returns', f"returns_archive_{cutoff:%Y%m%d}_{datetime.now():%Y%m%dT%H%M%S}_{index}")
+    try:
+        for row in rows:
+            writer.write(row)
+        writer.close()
+        conn.commit()
+    except Exception:
+        writer.abort()
+        if os.path.exists(writer.filename):
+            os.remove(writer.filename)
+        raise
+    return writer.filename
+
+
+if __name__ == '__main__':
+    from database import get_db
+
+    parser = argparse.ArgumentParser(description='Create upcoming returns partitions and archive old closed returns')
+    parser.add_argument('--archive', action='store_true',
+                        help='move approved/rejected returns older than the retention window out of returns')
+    parser.add_argument('--retention-days', type=int, default=ARCHIVE_RETENTION_DAYS)
+    parser.add_argument('--parquet-dir', help='write archived returns to Parquet files here instead of returns_archive')
+    args = parser.parse_args()
+
+    conn = get_db()
+    cur = conn.cursor()
+    for name in ensure_partitions(cur):
+        print(f"Created partition {name}")
+    conn.commit()
+    cur.close()
+
+    if args.archive:
+        archived, files = archive_returns(conn, args.retention_days, args.parquet_dir)
+        print(f"Archived {archived} returns" + (f" into {len(files)} Parquet files" if files else ''))
+    conn.close()
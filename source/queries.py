@@ -0,0 +1,226 @@
+import re
+from datetime import date, datetime
+from migrations import CUSTOMER_SEARCH_EXPR, RETURN_SEARCH_CONFIG
+from partitions import RETURN_COLUMNS
+from database import PREPARE_STATEMENTS, PREPARED_STATEMENTS_MAX
+
+# SQL shared by the Flask routes (psycopg2) and the async API (asyncpg, via numbered())
+
+RETURN_STATUSES = ('pending', 'approved', 'rejected')
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Listing queries fetch the smallest of these that covers the page, so a prepared listing has a
+# handful of LIMIT variants rather than one per requested page size
+FETCH_SIZES = (10, 25, 50, 100, MAX_PAGE_SIZE)
+CUSTOMER_SEARCH_LIMIT = 10
+MAX_CUSTOMER_SEARCH_LIMIT = 50
+# pg_trgm extracts no trigram from a shorter %term% pattern, so the GIN index could not serve it
+CUSTOMER_SEARCH_MIN_LENGTH = 3
+MAX_SEARCH_QUERY_LENGTH = 200
+
+SELLERS_SQL = "SELECT id, name, email FROM users WHERE user_type = 'seller' ORDER BY name"
+
+CUSTOMERS_SQL = "SELECT id, first_name, last_name, email FROM customers ORDER BY last_name, first_name"
+
+CUSTOMER_BY_ID_SQL = "SELECT id, first_name, last_name, email FROM customers WHERE id = %s"
+
+CUSTOMER_SEARCH_SQL = f'''
+                      SELECT id, first_name, last_name, email
+                      FROM customers
+                      WHERE {CUSTOMER_SEARCH_EXPR} LIKE %s
+                      ORDER BY similarity({CUSTOMER_SEARCH_EXPR}, %s) DESC, last_name, first_name
+                      LIMIT %s
+                      '''
+
+# Columns are listed so the search_vector column never reaches templates or JSON
+RETURNS_COLUMNS_SQL = f'''
+                      SELECT
+                          {', '.join('r.' + column for column in RETURN_COLUMNS)},
+                          s.name as seller_name,
+                          c.first_name as customer_first_name,
+                          c.last_name as customer_last_name,
+                          a.name as admin_name
+                      '''
+
+RETURNS_FROM_SQL = '''
+                   FROM returns r
+                            LEFT JOIN users s ON r.seller_id = s.id
+                            LEFT JOIN customers c ON r.customer_id = c.id
+                            LEFT JOIN users a ON r.admin_id = a.id
+                   '''
+
+RETURNS_SELECT = RETURNS_COLUMNS_SQL + RETURNS_FROM_SQL
+
+RETURN_BY_ID_SQL = RETURNS_SELECT + ' WHERE r.id = %s'
+
+# Ranked full-text search; the outer query exists so the keyset condition can refer to rank
+RETURNS_SEARCH_SQL = (
+    'SELECT * FROM (' + RETURNS_COLUMNS_SQL + ', ts_rank_cd(r.search_vector, query) AS rank' + RETURNS_FROM_SQL +
+    f", websearch_to_tsquery('{RETURN_SEARCH_CONFIG}', %s) query WHERE r.search_vector @@ query {{conditions}}"
+    ') ranked {cursor} ORDER BY rank DESC, created_at DESC, id DESC LIMIT %s'
+)
+
+INSERT_RETURN_SQL = '''
+                    INSERT INTO returns
+                        (seller_id, customer_id, purchase_date, product_name, reason)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING id
+                    '''
+
+UPDATE_RETURN_SQL = '''
+                    UPDATE returns
+                    SET status = %s, comment = %s, admin_id = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    RETURNING id
+                    '''
+
+
+def numbered(sql):
+    # psycopg2 %s placeholders -> asyncpg $1, $2, ...
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda match: f'${next(counter)}', sql)
+
+
+def execute_prepared(cur, sql, params=()):
+    # Parsed and planned once per connection, then run with EXECUTE; prepared statements outlive
+    # transactions, so the pool keeps them for the connection's lifetime
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None or not PREPARE_STATEMENTS:
+        return cur.execute(sql, params)
+
+    name = prepared.get(sql)
+    if name is None:
+        conn.statements += 1
+        name = f"stmt_{conn.statements}"
+        cur.execute(f"PREPARE {name} AS {numbered(sql)}")
+        prepared[sql] = name
+        while len(prepared) > PREPARED_STATEMENTS_MAX:
+            _, evicted = prepared.popitem(last=False)
+            cur.execute(f"DEALLOCATE {evicted}")
+    else:
+        prepared.move_to_end(sql)
+    arguments = f" ({', '.join(['%s'] * len(params))})" if params else ''
+    return cur.execute(f"EXECUTE {name}{arguments}", params)
+
+
+def parse_int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def encode_cursor(row):
+    cursor = f"{row['created_at'].isoformat()},{row['id']}"
+    if 'rank' in row:
+        cursor = f"{row['rank']!r},{cursor}"
+    return cursor
+
+
+def decode_cursor(cursor, ranked=False):
+    try:
+        if ranked:
+            rank, created_at, return_id = cursor.split(',')
+            return float(rank), datetime.fromisoformat(created_at), int(return_id)
+        created_at, return_id = cursor.rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(return_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_return_filters(args):
+    # args may be a query string or a JSON object, so values that are not strings are ignored
+    filters = {}
+    if args.get('status') in RETURN_STATUSES:
+        filters['status'] = args['status']
+    for key in ('seller_id', 'customer_id'):
+        value = parse_int(args.get(key))
+        if value:
+            filters[key] = value
+    for key in ('purchase_date_from', 'purchase_date_to'):
+        value = args.get(key)
+        if isinstance(value, str):
+            try:
+                filters[key] = date.fromisoformat(value).isoformat()
+            except ValueError:
+                pass
+    query = args.get('q')
+    if isinstance(query, str):
+        query = query.strip()[:MAX_SEARCH_QUERY_LENGTH]
+        if query:
+            filters['q'] = query
+    return filters
+
+
+def parse_page_size(args):
+    limit = parse_int(args.get('limit'), PAGE_SIZE)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_search_limit(args):
+    limit = parse_int(args.get('limit'), CUSTOMER_SEARCH_LIMIT)
+    return max(1, min(limit, MAX_CUSTOMER_SEARCH_LIMIT))
+
+
+def build_returns_where(filters, cursor=None):
+    conditions = []
+    params = []
+    if 'status' in filters:
+        conditions.append('r.status = %s')
+        params.append(filters['status'])
+    if 'seller_id' in filters:
+        conditions.append('r.seller_id = %s')
+        params.append(filters['seller_id'])
+    if 'customer_id' in filters:
+        conditions.append('r.customer_id = %s')
+        params.append(filters['customer_id'])
+    if 'purchase_date_from' in filters:
+        conditions.append('r.purchase_date >= %s')
+        params.append(date.fromisoformat(filters['purchase_date_from']))
+    if 'purchase_date_to' in filters:
+        conditions.append('r.purchase_date <= %s')
+        params.append(date.fromisoformat(filters['purchase_date_to']))
+    if cursor:
+        conditions.append('(r.created_at, r.id) < (%s, %s)')
+        params.extend(cursor)
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return where, params
+
+
+def returns_page_query(filters, cursor, limit):
+    # Keyset pagination on (created_at, id): one page plus a lookahead row
+    filters = filters or {}
+    if filters.get('q'):
+        return returns_search_query(filters, cursor, limit)
+    # LIMIT is inlined from FETCH_SIZES: as a parameter the planner costs a prepared listing for an
+    # unknown row count and never settles on the generic plan. split_page trims the extra rows.
+    where, params = build_returns_where(filters, decode_cursor(cursor))
+    fetch = next((size for size in FETCH_SIZES if size >= limit), int(limit))
+    return RETURNS_SELECT + where + f' ORDER BY r.created_at DESC, r.id DESC LIMIT {fetch + 1}', params
+
+
+def returns_search_query(filters, cursor, limit):
+    # Best match first, keyset on (rank, created_at, id); rank is real, so the cursor value is cast back to it
+    where, params = build_returns_where(filters)
+    conditions = where.replace(' WHERE ', ' AND ', 1)
+    position = decode_cursor(cursor, ranked=True)
+    cursor_sql = 'WHERE (rank, created_at, id) < (%s::real, %s, %s)' if position else ''
+    sql = RETURNS_SEARCH_SQL.format(conditions=conditions, cursor=cursor_sql)
+    return sql, [filters['q']] + params + list(position or []) + [limit + 1]
+
+
+def split_page(rows, limit):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def customer_search_params(query, limit):
+    term = query.strip().lower()
+    if len(term) < CUSTOMER_SEARCH_MIN_LENGTH:
+        return None
+    pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return [pattern, term, limit]
@@ -0,0 +1,117 @@
+from collections import namedtuple
+from functools import lru_cache
+from psycopg2 import extensions
+
+# Compact rows for the large read paths. A RealDictRow is a dict per row repeating every column
+# name; a Record is a tuple whose column names live once on its class. Templates read columns as
+# attributes, the exporter and JSON code by key, so both accept it where they took a dict.
+
+TEMPORAL_TYPE_CODES = frozenset(extensions.PYDATE.values + extensions.PYDATETIME.values +
+                                extensions.PYDATETIMETZ.values)
+
+
+@lru_cache(maxsize=256)
+def record_type(columns, temporal=()):
+    base = namedtuple('Record', columns, rename=True)
+    index = {column: position for position, column in enumerate(columns)}
+
+    class Record(base):
+        __slots__ = ()
+
+        # Positions of date/time columns, so serializing a row only touches those values
+        temporal_positions = temporal
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                return tuple.__getitem__(self, index[key])
+            return tuple.__getitem__(self, key)
+
+        def __contains__(self, key):
+            return key in index
+
+        def get(self, key, default=None):
+            position = index.get(key)
+            return default if position is None else tuple.__getitem__(self, position)
+
+        def keys(self):
+            return columns
+
+        def values(self):
+            return tuple(self)
+
+        def items(self):
+            return zip(columns, self)
+
+        def _asdict(self):
+            return dict(zip(columns, self))
+
+    return Record
+
+
+def description_record_type(description):
+    columns = tuple(column.name for column in description)
+    temporal = tuple(position for position, column in enumerate(description)
+                     if column.type_code in TEMPORAL_TYPE_CODES)
+    return record_type(columns, temporal)
+
+
+def serializable_record(record):
+    # Same record with dates and timestamps as ISO strings, for the text export formats
+    if not record.temporal_positions:
+        return record
+    values = list(record)
+    for position in record.temporal_positions:
+        if values[position] is not None:
+            values[position] = values[position].isoformat()
+    return record._make(values)
+
+
+def as_dicts(records):
+    return [record._asdict() for record in records]
+
+
+class RecordCursor(extensions.cursor):
+    # Cursor factory returning Records; the record class is built once per result shape
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._make = None
+
+    def execute(self, query, vars=None):
+        self._make = None
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        self._make = None
+        return super().executemany(query, vars_list)
+
+    def callproc(self, procname, vars=None):
+        self._make = None
+        return super().callproc(procname, vars)
+
+    def _maker(self):
+        # Named cursors only have a description after their first fetch
+        if self._make is None:
+            self._make = description_record_type(self.description)._make
+        return self._make
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self._maker()(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return list(map(self._maker(), rows)) if rows else rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        return list(map(self._maker(), rows)) if rows else rows
+
+    def __iter__(self):
+        rows = super().__iter__()
+        first = next(rows, None)
+        if first is None:
+            return
+        make = self._maker()
+        yield make(first)
+        yield from map(make, rows)
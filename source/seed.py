@@ -0,0 +1,204 @@
+import argparse
+import csv
+import io
+import random
+from datetime import date, datetime, timedelta
+from psycopg2.extras import execute_values
+from summary import rebuild_summary_tables
+from partitions import ensure_partitions
+
+SAMPLE_USERS = [
+    ('John Smith', 'seller', 'john.smith@store.com'),
+    ('Maria Johnson', 'seller', 'maria.johnson@store.com'),
+    ('Alex Brown', 'seller', 'alex.brown@store.com'),
+    ('Emily Davis', 'seller', 'emily.davis@store.com'),
+    ('Admin User', 'admin', 'admin@store.com')
+]
+
+SAMPLE_CUSTOMERS = [
+    ('Michael', 'Johnson', 'michael.johnson@email.com', '+1-555-0101'),
+    ('Sarah', 'Williams', 'sarah.williams@email.com', '+1-555-0102'),
+    ('David', 'Miller', 'david.miller@email.com', '+1-555-0103'),
+    ('Lisa', 'Anderson', 'lisa.anderson@email.com', '+1-555-0104'),
+    ('Robert', 'Taylor', 'robert.taylor@email.com', '+1-555-0105')
+]
+
+SAMPLE_RETURNS = [
+    (1, 1, None, '2024-01-15', 'MacBook Pro 16"', 'Screen has dead pixels', 'pending', None),
+    (2, 2, None, '2024-01-12', 'iPhone 15 Pro', 'Battery draining too fast', 'pending', None),
+    (3, 3, None, '2024-01-10', 'Samsung Galaxy S24', 'Camera not focusing properly', 'pending', None),
+    (1, 4, None, '2024-01-08', 'Sony WH-1000XM5', 'Right earphone not working', 'pending', None),
+    (2, 5, None, '2024-01-05', 'iPad Air', 'Touch screen unresponsive', 'pending', None)
+]
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Charles', 'Karen', 'Daniel', 'Nancy', 'Matthew', 'Lisa', 'Anthony', 'Betty', 'Mark', 'Sandra']
+
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore',
+              'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Lewis']
+
+PRODUCTS = ['MacBook Pro 16"', 'MacBook Air 13"', 'iPhone 15 Pro', 'iPhone 15', 'iPad Air', 'iPad Pro',
+            'Samsung Galaxy S24', 'Samsung Galaxy Tab S9', 'Google Pixel 8', 'Sony WH-1000XM5',
+            'AirPods Pro', 'Dell XPS 13', 'Lenovo ThinkPad X1', 'Kindle Paperwhite', 'Nintendo Switch',
+            'PlayStation 5', 'Apple Watch Series 9', 'Garmin Forerunner 265', 'Canon EOS R50', 'LG OLED C3']
+
+REASONS = ['Screen has dead pixels', 'Battery draining too fast', 'Camera not focusing properly',
+           'Right earphone not working', 'Touch screen unresponsive', 'Arrived damaged in shipping',
+           'Wrong color delivered', 'Does not turn on', 'Overheats during normal use',
+           'Missing accessories in the box', 'Changed my mind', 'Better price found elsewhere',
+           'Bluetooth keeps disconnecting', 'Charging port loose', 'Speaker crackles at high volume']
+
+ADMIN_COMMENTS = {
+    'approved': ['Defect confirmed, refund issued', 'Replacement shipped', 'Within return window'],
+    'rejected': ['Outside return window', 'Damage caused by user', 'Item not in original condition']
+}
+
+STATUS_WEIGHTS = [('pending', 60), ('approved', 25), ('rejected', 15)]
+
+
+def seed_sample_data(cur):
+    execute_values(cur, "INSERT INTO users (name, user_type, email) VALUES %s", SAMPLE_USERS)
+    print(f"Added {len(SAMPLE_USERS)} users")
+
+    execute_values(cur, "INSERT INTO customers (first_name, last_name, email, phone) VALUES %s", SAMPLE_CUSTOMERS)
+    print(f"Added {len(SAMPLE_CUSTOMERS)} customers")
+
+    execute_values(
+        cur,
+        "INSERT INTO returns (seller_id, customer_id, admin_id, purchase_date, product_name, reason, status, comment) VALUES %s",
+        SAMPLE_RETURNS
+    )
+    print(f"Added {len(SAMPLE_RETURNS)} returns")
+
+
+def copy_rows(cur, table, columns, rows, batch_size=50000):
+    # COPY in fixed-size CSV chunks so memory stays flat however many rows are generated
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    total = 0
+    while True:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count == batch_size:
+                break
+        if not count:
+            return total
+        buffer.seek(0)
+        cur.copy_expert(statement, buffer)
+        total += count
+        if count < batch_size:
+            return total
+
+
+def generate_sellers(rng, count, offset):
+    for index in range(offset, offset + count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield (f"{first_name} {last_name}", 'seller',
+               f"{first_name.lower()}.{last_name.lower()}.{index}@store.com")
+
+
+def generate_customers(rng, count, offset):
+    for index in range(offset, offset + count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield (first_name, last_name,
+               f"{first_name.lower()}.{last_name.lower()}.{index}@email.com",
+               f"+1-555-{rng.randrange(10000):04d}")
+
+
+def generate_returns(rng, count, seller_ids, customer_ids, admin_ids, start, days):
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    weights = [weight for _, weight in STATUS_WEIGHTS]
+
+    for _ in range(count):
+        purchase_date = start + timedelta(days=rng.randrange(days))
+        created_at = datetime.combine(purchase_date, datetime.min.time()) + timedelta(
+            days=rng.randrange(1, 31), seconds=rng.randrange(86400))
+        status = rng.choices(statuses, weights)[0]
+
+        admin_id = comment = None
+        updated_at = created_at
+        if status != 'pending':
+            admin_id = rng.choice(admin_ids)
+            comment = rng.choice(ADMIN_COMMENTS[status])
+            updated_at = created_at + timedelta(hours=rng.randrange(1, 240))
+
+        yield (rng.choice(seller_ids), rng.choice(customer_ids), admin_id, purchase_date,
+               rng.choice(PRODUCTS), rng.choice(REASONS), status, comment, created_at, updated_at)
+
+
+def fetch_ids(cur, query):
+    cur.execute(query)
+    return [row[0] for row in cur.fetchall()]
+
+
+def seed_synthetic(cur, sellers=10, customers=1000, returns=10000, seed=42, batch_size=50000,
+                   start=date(2023, 1, 1), days=730):
+    # Same seed, same rows: runs at a given scale are comparable
+    rng = random.Random(seed)
+    print(f"Generating {sellers} sellers, {customers} customers and {returns} returns (seed {seed})")
+
+    cur.execute("SELECT COUNT(*) FROM users")
+    offset = cur.fetchone()[0]
+    copy_rows(cur, 'users', ['name', 'user_type', 'email'],
+              generate_sellers(rng, sellers, offset), batch_size)
+
+    cur.execute("SELECT COUNT(*) FROM customers")
+    offset = cur.fetchone()[0]
+    copy_rows(cur, 'customers', ['first_name', 'last_name', 'email', 'phone'],
+              generate_customers(rng, customers, offset), batch_size)
+
+    seller_ids = fetch_ids(cur, "SELECT id FROM users WHERE user_type = 'seller' ORDER BY id")
+    admin_ids = fetch_ids(cur, "SELECT id FROM users WHERE user_type = 'admin' ORDER BY id")
+    customer_ids = fetch_ids(cur, "SELECT id FROM customers ORDER BY id")
+
+    # created_at runs up to 30 days past the last purchase date
+    ensure_partitions(cur, start, start + timedelta(days=days + 31))
+
+    # Per-row summary triggers would dominate a bulk load; recount once afterwards instead.
+    # Live admin pages are not told about the load either
+    cur.execute("ALTER TABLE returns DISABLE TRIGGER returns_summary_insert_delete")
+    cur.execute("ALTER TABLE returns DISABLE TRIGGER returns_notify_insert")
+    copied = copy_rows(
+        cur, 'returns',
+        ['seller_id', 'customer_id', 'admin_id', 'purchase_date', 'product_name', 'reason',
+         'status', 'comment', 'created_at', 'updated_at'],
+        generate_returns(rng, returns, seller_ids, customer_ids, admin_ids, start, days),
+        batch_size
+    )
+    cur.execute("ALTER TABLE returns ENABLE TRIGGER returns_summary_insert_delete")
+    cur.execute("ALTER TABLE returns ENABLE TRIGGER returns_notify_insert")
+    rebuild_summary_tables(cur)
+
+    cur.execute("ANALYZE users")
+    cur.execute("ANALYZE customers")
+    cur.execute("ANALYZE returns")
+    print(f"Loaded {copied} synthetic returns")
+
+
+def seed_arguments(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--sellers', type=int, default=10)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--returns', type=int, default=0,
+                        help='number of synthetic returns to generate on top of the sample data')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser
+
+
+if __name__ == '__main__':
+    from database import get_db
+    from cache import invalidate_lookups
+
+    args = seed_arguments('Append synthetic sellers, customers and returns to an existing database').parse_args()
+    conn = get_db()
+    cur = conn.cursor()
+    seed_synthetic(cur, args.sellers, args.customers, args.returns or 10000, args.seed)
+    conn.commit()
+    invalidate_lookups()
+    cur.close()
+    conn.close()
@@ -0,0 +1,122 @@
+def create_summary_tables(cur):
+    # Dashboard counters maintained by trigger so reads never scan returns
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS return_status_counts (
+                                                      status VARCHAR(20) PRIMARY KEY,
+                                                      count BIGINT NOT NULL DEFAULT 0
+                )
+                ''')
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS return_daily_counts (
+                                                     seller_id INTEGER NOT NULL,
+                                                     day DATE NOT NULL,
+                                                     status VARCHAR(20) NOT NULL,
+                                                     count BIGINT NOT NULL DEFAULT 0,
+                                                     PRIMARY KEY (seller_id, day, status)
+                )
+                ''')
+    # Per-seller totals for the dashboard, so it reads sellers x statuses rows however long the history
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS return_seller_counts (
+                                                      seller_id INTEGER NOT NULL,
+                                                      status VARCHAR(20) NOT NULL,
+                                                      count BIGINT NOT NULL DEFAULT 0,
+                                                      PRIMARY KEY (seller_id, status)
+                )
+                ''')
+    cur.execute('''
+                CREATE OR REPLACE FUNCTION returns_summary_apply(p_seller_id INTEGER, p_created_at TIMESTAMP,
+                                                                 p_status VARCHAR, p_delta INTEGER)
+                RETURNS void AS $$
+                BEGIN
+                    IF p_status IS NULL OR p_created_at IS NULL THEN
+                        RETURN;
+                    END IF;
+                    INSERT INTO return_status_counts (status, count) VALUES (p_status, p_delta)
+                    ON CONFLICT (status) DO UPDATE SET count = return_status_counts.count + EXCLUDED.count;
+                    INSERT INTO return_daily_counts (seller_id, day, status, count)
+                    VALUES (p_seller_id, p_created_at::date, p_status, p_delta)
+                    ON CONFLICT (seller_id, day, status)
+                        DO UPDATE SET count = return_daily_counts.count + EXCLUDED.count;
+                    INSERT INTO return_seller_counts (seller_id, status, count)
+                    VALUES (p_seller_id, p_status, p_delta)
+                    ON CONFLICT (seller_id, status)
+                        DO UPDATE SET count = return_seller_counts.count + EXCLUDED.count;
+                END;
+                $$ LANGUAGE plpgsql
+                ''')
+    cur.execute('''
+                CREATE OR REPLACE FUNCTION returns_summary_trigger() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        PERFORM returns_summary_apply(OLD.seller_id, OLD.created_at, OLD.status, -1);
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        PERFORM returns_summary_apply(NEW.seller_id, NEW.created_at, NEW.status, 1);
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+                ''')
+    cur.execute('DROP TRIGGER IF EXISTS returns_summary_insert_delete ON returns')
+    cur.execute('DROP TRIGGER IF EXISTS returns_summary_update ON returns')
+    cur.execute('''
+                CREATE TRIGGER returns_summary_insert_delete
+                    AFTER INSERT OR DELETE ON returns
+                    FOR EACH ROW EXECUTE FUNCTION returns_summary_trigger()
+                ''')
+    cur.execute('''
+                CREATE TRIGGER returns_summary_update
+                    AFTER UPDATE OF status, seller_id, created_at ON returns
+                    FOR EACH ROW
+                    WHEN (OLD.status IS DISTINCT FROM NEW.status
+                        OR OLD.seller_id IS DISTINCT FROM NEW.seller_id
+                        OR OLD.created_at IS DISTINCT FROM NEW.created_at)
+                    EXECUTE FUNCTION returns_summary_trigger()
+                ''')
+    print("Created return summary tables and triggers")
+
+def create_change_counter(cur):
+    # Bumped once per statement that writes returns and committed with it, so two readers see different
+    # versions whenever they can see different data; timestamps cannot, as they follow start, not commit, order
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS return_changes (
+                                                      id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                                                      version BIGINT NOT NULL DEFAULT 0
+                )
+                ''')
+    cur.execute('INSERT INTO return_changes (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING')
+    cur.execute('''
+                CREATE OR REPLACE FUNCTION returns_changes_trigger() RETURNS trigger AS $$
+                BEGIN
+                    UPDATE return_changes SET version = version + 1;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+                ''')
+    cur.execute('DROP TRIGGER IF EXISTS returns_changes ON returns')
+    cur.execute('''
+                CREATE TRIGGER returns_changes
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON returns
+                    FOR EACH STATEMENT EXECUTE FUNCTION returns_changes_trigger()
+                ''')
+
+def rebuild_summary_tables(cur):
+    cur.execute('TRUNCATE return_status_counts, return_daily_counts, return_seller_counts')
+    cur.execute('''
+                INSERT INTO return_status_counts (status, count)
+                SELECT status, COUNT(*) FROM returns
+                WHERE status IS NOT NULL AND created_at IS NOT NULL
+                GROUP BY status
+                ''')
+    cur.execute('''
+                INSERT INTO return_daily_counts (seller_id, day, status, count)
+                SELECT seller_id, created_at::date, status, COUNT(*) FROM returns
+                WHERE status IS NOT NULL AND created_at IS NOT NULL
+                GROUP BY seller_id, created_at::date, status
+                ''')
+    cur.execute('''
+                INSERT INTO return_seller_counts (seller_id, status, count)
+                SELECT seller_id, status, SUM(count) FROM return_daily_counts
+                GROUP BY seller_id, status
+                ''')